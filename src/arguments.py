@@ -0,0 +1,146 @@
+import re
+from os.path import join as p_join, abspath, isabs, isfile
+
+# 带有路径的参数，路径可以与参数连在一起(-Ifoo)，也可以是下一个参数(-I foo)；
+# 前缀相同的参数，较长的须放在前面
+PATH_ARGS = (
+    '-include-pch', '-include', '-imacros', '-isystem-after', '-isystem', '-isysroot', '-iquote', '-idirafter',
+    '-I', '-F',
+)
+# 与PATH_ARGS前缀相同，但不带路径的参数，须原样保留
+NON_PATH_ARGS = {'-I-'}
+# clang先在工作目录下查找这些文件，找不到时再到头文件搜索路径中查找，
+# 所以只有文件确实在directory下时才能转为绝对路径，比如-include config.h -Ibuild
+INCLUDE_FILE_ARGS = ('-include', '-imacros')
+# 以=连接路径的参数
+PATH_EQ_ARGS = ('--sysroot=',)
+PATH_SPLIT_ARGS = ('--sysroot',)
+
+# 与输出、依赖文件有关的参数，后一个元素表示是否带有单独的值
+OUTPUT_ARGS = {
+    '-c': False, '-S': False, '-o': True,
+    '-M': False, '-MM': False, '-MD': False, '-MMD': False, '-MP': False, '-MG': False,
+    '-MF': True, '-MT': True, '-MQ': True,
+    '-pipe': False, '-save-temps': False,
+}
+# 带有值的输出参数也可以与值连在一起，比如-ofoo.o，-MFfoo.d
+OUTPUT_PREFIXES = tuple(arg for arg, has_value in OUTPUT_ARGS.items() if has_value)
+# 以-Wp,传给预处理器的依赖文件参数，此时-MD与-MMD也带有文件名
+WP_DEP_ARGS = {
+    '-M': False, '-MM': False, '-MP': False, '-MG': False,
+    '-MD': True, '-MMD': True, '-MF': True, '-MT': True, '-MQ': True,
+}
+# 只影响代码生成(调试信息，优化，LTO，插桩等)的参数，不影响语法树
+CODEGEN_ARGS = {'-g', '-pg', '--coverage'}
+# 优化级别：-O，-O2，-Os，-Oz，-Og，-Ofast等，不能按前缀-O匹配，否则会去掉-ObjC，-ObjC++
+OPT_RE = re.compile(r'-O([0-9]*|s|z|g|fast)$')
+CODEGEN_PREFIXES = (
+    '-g0', '-g1', '-g2', '-g3', '-ggdb', '-gdwarf', '-gline', '-gsplit', '-gcolumn', '-gz', '-gno-',
+    '-flto', '-fno-lto', '-fsanitize', '-fno-sanitize', '-fprofile', '-fcoverage', '-fstack-protector',
+    '-ffunction-sections', '-fdata-sections', '-fdebug-prefix-map', '-Wl,', '-Wa,',
+)
+# 只做语法分析时的默认参数：不生成警告
+DEFAULT_ARGS = ('-fsyntax-only', '-w')
+
+
+def output_arg(arg: str):
+    """arg是输出或依赖文件相关的参数时，返回其值是否为下一个参数，否则返回None"""
+    if arg in OUTPUT_ARGS:
+        return OUTPUT_ARGS[arg]
+    if arg.startswith(OUTPUT_PREFIXES) and not arg.startswith('-objc'):
+        return False
+    return None
+
+
+def strip_wp(arg: str):
+    """去掉-Wp,中与依赖文件有关的参数，比如-Wp,-MD,foo.d，没有剩余的参数时返回None"""
+    kept = []
+    opts = iter(arg.split(',')[1:])
+    for opt in opts:
+        if opt in WP_DEP_ARGS:
+            if WP_DEP_ARGS[opt]:
+                next(opts, None)
+        else:
+            kept.append(opt)
+    return ','.join(['-Wp'] + kept) if kept else None
+
+
+class ArgRewriter:
+    """在交给libclang之前改写编译参数
+
+    1. 去掉输出、依赖文件以及代码生成相关的参数，它们会拖慢解析，或者让libclang写出多余的文件
+    2. 把所有带路径的参数中的相对路径转为绝对路径
+    3. 加入只做语法分析时的默认参数
+
+    源文件(最后一个参数)以外的参数相同的命令，改写的结果相同，按(目录, 参数)缓存
+    """
+
+    def __init__(self, drop=frozenset(CODEGEN_ARGS), drop_prefixes=CODEGEN_PREFIXES, defaults=DEFAULT_ARGS):
+        self.drop = drop
+        self.drop_prefixes = drop_prefixes
+        self.defaults = defaults
+        # (目录, 去掉输出参数后的参数) -> 改写后的参数
+        self._memo = {}
+
+    def strip(self, args: list) -> list:
+        """去掉输出与代码生成相关的参数"""
+        kept = []
+        args = iter(args)
+        for arg in args:
+            has_value = output_arg(arg)
+            if has_value is not None:
+                if has_value:
+                    next(args, None)
+            elif arg.startswith('-Wp,'):
+                arg = strip_wp(arg)
+                if arg is not None:
+                    kept.append(arg)
+            elif arg in self.drop or arg.startswith(self.drop_prefixes) or OPT_RE.match(arg):
+                continue
+            else:
+                kept.append(arg)
+        return kept
+
+    @staticmethod
+    def normalize(args: list, directory: str) -> list:
+        """将带路径的参数中的相对路径转为相对于directory的绝对路径"""
+        def absolute(arg: str, path: str) -> str:
+            if isabs(path):
+                return path
+            full = abspath(p_join(directory, path))
+            if arg in INCLUDE_FILE_ARGS and not isfile(full):
+                return path
+            return full
+
+        result = []
+        args = iter(args)
+        for arg in args:
+            # 先精确匹配参数的写法，再按前缀匹配连在一起的路径
+            if arg in NON_PATH_ARGS:
+                result.append(arg)
+                continue
+            if arg in PATH_ARGS or arg in PATH_SPLIT_ARGS:
+                path = next(args, None)
+                result.append(arg)
+                if path is not None:
+                    result.append(absolute(arg, path))
+                continue
+            prefix = next((p for p in PATH_EQ_ARGS + PATH_ARGS if arg.startswith(p)), None)
+            if prefix is not None:
+                arg = prefix + absolute(prefix, arg[len(prefix):])
+            result.append(arg)
+        return result
+
+    def rewrite(self, arguments: list, directory: str) -> list:
+        """改写一个编译命令，最后一个参数为源文件"""
+        flags = self.strip(arguments[:-1])
+        key = (directory, tuple(flags))
+        rewritten = self._memo.get(key)
+        if rewritten is None:
+            rewritten = self.normalize(flags, directory)
+            rewritten += [arg for arg in self.defaults if arg not in rewritten]
+            self._memo[key] = rewritten
+        source = arguments[-1]
+        if not isabs(source):
+            source = abspath(p_join(directory, source))
+        return rewritten + [source]
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import pickle
+from os.path import join as p_join
+
+from clang.cindex import TranslationUnit, TranslationUnitLoadError, TranslationUnitSaveError
+from history import dump_json, load_json
+
+# 参数中引用的文件，它们不会出现在get_includes的结果中
+FILE_ARGS = ('-include', '-include-pch', '-imacros')
+
+
+def digest(*parts) -> str:
+    return hashlib.sha1('\0'.join(str(part) for part in parts).encode('utf8')).hexdigest()
+
+
+def fingerprint(path: str):
+    """文件的指纹[mtime_ns, size]，文件不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def fingerprints(paths) -> dict:
+    return {path: fingerprint(path) for path in paths}
+
+
+def unchanged(deps: dict) -> bool:
+    """由fingerprints记录的文件是否都没有变化"""
+    return all(fingerprint(path) == fp for path, fp in deps.items())
+
+
+def dependencies(tu: TranslationUnit, cmd: list) -> set:
+    """编译单元依赖的所有文件：主文件，直接或间接包含的头文件，以及参数中引用的文件(比如PCH)"""
+    deps = {tu.spelling}
+    deps.update(include.include.name for include in tu.get_includes())
+    deps.update(arg for prev, arg in zip(cmd, cmd[1:]) if prev in FILE_ARGS)
+    return deps
+
+
+class AstCache:
+    """以内容寻址的AST缓存，命中时使用TranslationUnit.from_ast_file加载，无需重新解析
+
+    每个(编译参数, 解析选项)对应一个依赖清单，记录上次解析时所有依赖文件的指纹；
+    AST文件名为参数、选项与这些指纹的哈希，所以任何一个依赖文件变化后都不会再命中。
+    清单与AST都先写临时文件再替换，多个子进程可以同时读写
+    """
+
+    # 每个进程写入的AST累计超过max_size的这一比例时淘汰一次，总大小最多超出上限 进程数 * 该比例
+    EVICT_RATIO = 1 / 16
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        # AST文件的总大小上限(字节)，超过时按最近使用时间淘汰
+        self.max_size = max_size
+        # 当前进程自上次淘汰以来写入的字节数
+        self._written = 0
+        os.makedirs(p_join(directory, 'deps'), exist_ok=True)
+
+    def manifest(self, cmd: list, options: int) -> str:
+        return p_join(self.directory, 'deps', digest(options, *cmd) + '.json')
+
+    def ast_path(self, cmd: list, options: int, deps: dict) -> str:
+        key = digest(options, json.dumps(deps, sort_keys=True), *cmd)
+        return p_join(self.directory, key + '.ast')
+
+    def lookup(self, cmd: list, options: int):
+        """返回命中的AST文件路径，未命中时返回None"""
+        deps = load_json(self.manifest(cmd, options), None)
+        if deps is None or not unchanged(deps):
+            return None
+        path = self.ast_path(cmd, options, deps)
+        try:
+            # 更新修改时间，作为LRU淘汰的依据
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def load(self, index, cmd: list, options: int):
+        """从缓存中加载编译单元，未命中或加载失败时返回None"""
+        path = self.lookup(cmd, options)
+        if path is None:
+            return None
+        try:
+            return TranslationUnit.from_ast_file(path, index)
+        except TranslationUnitLoadError:
+            return None
+
+    def store(self, cmd: list, options: int, tu: TranslationUnit):
+        """保存编译单元，有错误而无法保存时忽略"""
+        deps = fingerprints(dependencies(tu, cmd))
+        path = self.ast_path(cmd, options, deps)
+        tmp = '{}.{}'.format(path, os.getpid())
+        try:
+            tu.save(tmp)
+        except TranslationUnitSaveError:
+            return
+        os.replace(tmp, path)
+        dump_json(deps, self.manifest(cmd, options))
+        # 运行期间就限制总大小，而不是等到所有编译单元处理完后才淘汰
+        self._written += os.path.getsize(path)
+        if self._written >= self.max_size * self.EVICT_RATIO:
+            self.evict()
+
+    def evict(self):
+        """删除最久未使用的AST文件，直到总大小不超过上限"""
+        self._written = 0
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.ast'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    # 已被其他进程淘汰
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class FactCache:
+    """以内容寻址的visitor数据(Visitor.facts)缓存，与AST缓存相互独立
+
+    键为编译单元的指纹与visitor的键(类名，版本等)的哈希，命中时既不用解析也不用加载AST；
+    不同的visitor各自缓存，增减其他visitor或修改与visitor无关的配置都不影响命中
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, tu_key: str, visitor_key: str) -> str:
+        return p_join(self.directory, digest(tu_key, visitor_key) + '.pickle')
+
+    def has(self, tu_key: str, visitor_key: str) -> bool:
+        return os.path.exists(self.path(tu_key, visitor_key))
+
+    def load(self, tu_key: str, visitor_key: str):
+        with open(self.path(tu_key, visitor_key), 'rb') as fp:
+            return pickle.load(fp)
+
+    def save(self, tu_key: str, visitor_key: str, facts):
+        path = self.path(tu_key, visitor_key)
+        tmp = '{}.{}'.format(path, os.getpid())
+        with open(tmp, 'wb') as fp:
+            pickle.dump(facts, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
@@ -286,6 +286,17 @@ class SourceLocation(Structure):
         """Get the file offset represented by this source location."""
         return self._get_instantiation()[3]
 
+    @property
+    def is_in_system_header(self):
+        """True if this source location is in a system header."""
+        return conf.lib.clang_Location_isInSystemHeader(self)
+
+    @property
+    def is_from_main_file(self):
+        """True if this source location is in the main file of its
+        translation unit."""
+        return conf.lib.clang_Location_isFromMainFile(self)
+
     def __eq__(self, other):
         return conf.lib.clang_equalLocations(self, other)
 
@@ -1855,6 +1866,57 @@ class Cursor(Structure):
             for descendant in child.walk_preorder():
                 yield descendant
 
+    def walk(self, callback, kinds=None):
+        """Depth-first preorder walk over the descendants of this cursor.
+
+        Unlike walk_preorder, the whole subtree is visited by a single
+        clang_visitChildren call returning CXChildVisit_Recurse, so there is
+        no Python recursion and no intermediate list of children.
+
+        callback(cursor, depth) is called for every descendant, depth being 1
+        for the direct children of this cursor. Its return value controls the
+        walk like a CXChildVisitResult: None or 2 (Recurse) visits the
+        children of cursor, 1 (Continue) skips them and 0 (Break) stops the
+        walk. An exception raised by callback stops the walk and is re-raised.
+
+        If kinds is given, it is a container of CursorKind values (integers)
+        and callback is only called for cursors whose kind is in it. Other
+        cursors are recursed into without leaving the visitor callback.
+        """
+        tu = self._tu
+        # The cursors on the path from self to the cursor being visited. The
+        # parent handed to the visitor is bitwise identical to the cursor that
+        # was visited when libclang recursed into it, so raw bytes are enough
+        # to recognize it without calling back into libclang.
+        stack = [bytes(self)]
+        errors = []
+
+        def visitor(child, parent, data):
+            key = bytes(parent)
+            while len(stack) > 1 and stack[-1] != key:
+                stack.pop()
+
+            if kinds is not None and child._kind_id not in kinds:
+                stack.append(bytes(child))
+                return 2 # recurse
+
+            child._tu = tu
+            try:
+                result = callback(child, len(stack))
+            except BaseException as e:
+                errors.append(e)
+                return 0 # break
+            if result is None:
+                result = 2 # recurse
+            if result == 2:
+                stack.append(bytes(child))
+            return result
+
+        conf.lib.clang_visitChildren(self, callbacks['cursor_visit'](visitor),
+            None)
+        if errors:
+            raise errors[0]
+
     def get_tokens(self):
         """Obtain Token instances formulating that compose this Cursor.
 
@@ -3318,6 +3380,337 @@ class Token(Structure):
 
         return cursor
 
+### Indexing ###
+
+class IndexEntityKind(BaseEnumeration):
+    """
+    An IndexEntityKind describes the kind of entity reported by the indexing
+    API (CXIdxEntityKind).
+    """
+
+    # The required BaseEnumeration declarations.
+    _kinds = []
+    _name_map = None
+
+IndexEntityKind.UNEXPOSED = IndexEntityKind(0)
+IndexEntityKind.TYPEDEF = IndexEntityKind(1)
+IndexEntityKind.FUNCTION = IndexEntityKind(2)
+IndexEntityKind.VARIABLE = IndexEntityKind(3)
+IndexEntityKind.FIELD = IndexEntityKind(4)
+IndexEntityKind.ENUM_CONSTANT = IndexEntityKind(5)
+IndexEntityKind.OBJC_CLASS = IndexEntityKind(6)
+IndexEntityKind.OBJC_PROTOCOL = IndexEntityKind(7)
+IndexEntityKind.OBJC_CATEGORY = IndexEntityKind(8)
+IndexEntityKind.OBJC_INSTANCE_METHOD = IndexEntityKind(9)
+IndexEntityKind.OBJC_CLASS_METHOD = IndexEntityKind(10)
+IndexEntityKind.OBJC_PROPERTY = IndexEntityKind(11)
+IndexEntityKind.OBJC_IVAR = IndexEntityKind(12)
+IndexEntityKind.ENUM = IndexEntityKind(13)
+IndexEntityKind.STRUCT = IndexEntityKind(14)
+IndexEntityKind.UNION = IndexEntityKind(15)
+IndexEntityKind.CXX_CLASS = IndexEntityKind(16)
+IndexEntityKind.CXX_NAMESPACE = IndexEntityKind(17)
+IndexEntityKind.CXX_NAMESPACE_ALIAS = IndexEntityKind(18)
+IndexEntityKind.CXX_STATIC_VARIABLE = IndexEntityKind(19)
+IndexEntityKind.CXX_STATIC_METHOD = IndexEntityKind(20)
+IndexEntityKind.CXX_INSTANCE_METHOD = IndexEntityKind(21)
+IndexEntityKind.CXX_CONSTRUCTOR = IndexEntityKind(22)
+IndexEntityKind.CXX_DESTRUCTOR = IndexEntityKind(23)
+IndexEntityKind.CXX_CONVERSION_FUNCTION = IndexEntityKind(24)
+IndexEntityKind.CXX_TYPE_ALIAS = IndexEntityKind(25)
+IndexEntityKind.CXX_INTERFACE = IndexEntityKind(26)
+IndexEntityKind.CXX_CONCEPT = IndexEntityKind(27)
+
+def _index_string(value):
+    """Convert a char* field of an indexing structure to a str."""
+    if value is None or isinstance(value, str):
+        return value
+    return value.decode('utf8')
+
+class IdxLoc(Structure):
+    """
+    A source location as reported by the indexing API (CXIdxLoc).
+    """
+    _fields_ = [("ptr_data", c_void_p * 2), ("int_data", c_uint)]
+
+    @property
+    def location(self):
+        """Return the SourceLocation of this index location."""
+        return conf.lib.clang_indexLoc_getCXSourceLocation(self)
+
+class IdxAttrInfo(Structure):
+    """
+    An attribute attached to an indexed entity (CXIdxAttrInfo).
+    """
+    _fields_ = [("kind", c_int), ("_cursor", Cursor), ("loc", IdxLoc)]
+
+class IdxEntityInfo(Structure):
+    """
+    An entity as reported by the indexing API (CXIdxEntityInfo).
+    """
+    _fields_ = [
+        ("_kind", c_int),
+        ("template_kind", c_int),
+        ("lang", c_int),
+        ("_name", c_char_p),
+        ("_usr", c_char_p),
+        ("attributes", POINTER(POINTER(IdxAttrInfo))),
+        ("num_attributes", c_uint),
+    ]
+
+    @property
+    def kind(self):
+        """Return the IndexEntityKind of this entity."""
+        return IndexEntityKind.from_id(self._kind)
+
+    @property
+    def name(self):
+        """Return the name of this entity, or None if it is anonymous."""
+        return _index_string(self._name)
+
+    @property
+    def usr(self):
+        """Return the Unified Symbol Resolution (USR) of this entity."""
+        return _index_string(self._usr)
+
+class IdxContainerInfo(Structure):
+    """
+    The semantic or lexical container of an indexed entity (CXIdxContainerInfo).
+    """
+    _fields_ = [("_cursor", Cursor)]
+
+class _IdxInfo(Structure):
+    """
+    Shared accessors of the structures passed to the indexer callbacks.
+
+    Instances only live for the duration of the callback; the translation unit
+    is attached by IndexAction so that cursors can be queried.
+    """
+
+    @property
+    def cursor(self):
+        """Return a copy of the cursor of this declaration or reference."""
+        cursor = Cursor.from_buffer_copy(self._cursor)
+        cursor._tu = self._tu
+        return cursor
+
+    @property
+    def location(self):
+        """Return the SourceLocation of this declaration or reference."""
+        return self._loc.location
+
+class IdxDeclInfo(_IdxInfo):
+    """
+    A declaration as reported by the indexing API (CXIdxDeclInfo).
+    """
+    _fields_ = [
+        ("_entity", POINTER(IdxEntityInfo)),
+        ("_cursor", Cursor),
+        ("_loc", IdxLoc),
+        ("semantic_container", POINTER(IdxContainerInfo)),
+        ("lexical_container", POINTER(IdxContainerInfo)),
+        ("is_redeclaration", c_int),
+        ("is_definition", c_int),
+        ("is_container", c_int),
+        ("decl_as_container", POINTER(IdxContainerInfo)),
+        ("is_implicit", c_int),
+        ("attributes", POINTER(POINTER(IdxAttrInfo))),
+        ("num_attributes", c_uint),
+        ("flags", c_uint),
+    ]
+
+    @property
+    def entity(self):
+        """Return the IdxEntityInfo of the declared entity."""
+        return self._entity.contents
+
+class IdxEntityRefInfo(_IdxInfo):
+    """
+    A reference to an entity as reported by the indexing API
+    (CXIdxEntityRefInfo).
+    """
+    _fields_ = [
+        ("kind", c_int),
+        ("_cursor", Cursor),
+        ("_loc", IdxLoc),
+        ("_referenced", POINTER(IdxEntityInfo)),
+        ("_parent", POINTER(IdxEntityInfo)),
+        ("container", POINTER(IdxContainerInfo)),
+        ("role", c_int),
+    ]
+
+    @property
+    def referenced(self):
+        """Return the IdxEntityInfo of the referenced entity."""
+        return self._referenced.contents
+
+    @property
+    def parent(self):
+        """
+        Return the IdxEntityInfo of the entity containing this reference, or
+        None if the reference is at global scope.
+        """
+        if not self._parent:
+            return None
+        return self._parent.contents
+
+class IndexAction(ClangObject):
+    """
+    An IndexAction (CXIndexAction) drives the libclang indexing API.
+
+    The indexer walks the translation unit in C and only calls back into Python
+    for the declarations and entity references it reports, which is much
+    cheaper than visiting every cursor.
+    """
+
+    # CXIndexOptFlags, to be or'ed together and passed as options.
+    INDEX_OPT_NONE = 0x0
+
+    # Report only one reference of an entity per source file that does not
+    # also include a declaration or definition of the entity.
+    INDEX_OPT_SUPPRESS_REDUNDANT_REFS = 0x1
+
+    # Report declarations and references of function-local symbols.
+    INDEX_OPT_INDEX_FUNCTION_LOCAL_SYMBOLS = 0x2
+
+    # Report implicit template instantiations.
+    INDEX_OPT_INDEX_IMPLICIT_TEMPLATE_INSTANTIATIONS = 0x4
+
+    # Suppress all compiler warnings when parsing for indexing.
+    INDEX_OPT_SUPPRESS_WARNINGS = 0x8
+
+    # Skip function bodies that were already parsed during an indexing
+    # session shared by several IndexAction calls.
+    INDEX_OPT_SKIP_PARSED_BODIES_IN_SESSION = 0x10
+
+    @staticmethod
+    def create(index):
+        """Create a new IndexAction bound to the given Index."""
+        return IndexAction(conf.lib.clang_IndexAction_create(index), index)
+
+    def __init__(self, ptr, index):
+        assert isinstance(index, Index)
+        self.index = index
+        ClangObject.__init__(self, ptr)
+
+    def __del__(self):
+        conf.lib.clang_IndexAction_dispose(self)
+
+    @staticmethod
+    def _callbacks(tu, on_declaration, on_reference, errors):
+        """
+        Build the IndexerCallbacks structure wrapping the Python callbacks.
+
+        Exceptions cannot propagate through the C library; the first one is
+        recorded in errors and the remaining events are ignored.
+        """
+        callbacks = IndexerCallbacks()
+
+        if on_declaration is not None:
+            def declaration(client_data, info):
+                if errors:
+                    return
+                info = info.contents
+                info._tu = tu
+                try:
+                    on_declaration(info)
+                except BaseException as e:
+                    errors.append(e)
+
+            callbacks.indexDeclaration = \
+                callbacks_index['declaration'](declaration)
+
+        if on_reference is not None:
+            def reference(client_data, info):
+                if errors:
+                    return
+                info = info.contents
+                info._tu = tu
+                try:
+                    on_reference(info)
+                except BaseException as e:
+                    errors.append(e)
+
+            callbacks.indexEntityReference = \
+                callbacks_index['entity_reference'](reference)
+
+        return callbacks
+
+    def index_translation_unit(self, tu, on_declaration=None,
+                               on_reference=None, options=0):
+        """
+        Index an already parsed TranslationUnit.
+
+        on_declaration is called with an IdxDeclInfo for every declaration and
+        on_reference with an IdxEntityRefInfo for every entity reference. Both
+        structures are only valid for the duration of the call.
+
+        options is a bitwise or of IndexAction.INDEX_OPT_XXX flags.
+        """
+        errors = []
+        callbacks = self._callbacks(tu, on_declaration, on_reference, errors)
+        result = conf.lib.clang_indexTranslationUnit(self, None,
+                                    byref(callbacks), sizeof(callbacks),
+                                    options, tu)
+        if errors:
+            raise errors[0]
+        if result != 0:
+            raise TranslationUnitLoadError("Error indexing translation unit.")
+
+    def index_source_file(self, filename, args=None, unsaved_files=None,
+                          on_declaration=None, on_reference=None, options=0,
+                          tu_options=0):
+        """
+        Parse and index a source file, returning the TranslationUnit.
+
+        args, unsaved_files and tu_options have the same meaning as the
+        arguments of TranslationUnit.from_source; on_declaration, on_reference
+        and options are as in index_translation_unit. Cursors reported during
+        indexing have no TranslationUnit attached since it does not exist yet;
+        use index_translation_unit if the callbacks need to query them.
+
+        If an error occurs, a TranslationUnitLoadError is raised.
+        """
+        if args is None:
+            args = []
+
+        if unsaved_files is None:
+            unsaved_files = []
+
+        args_array = None
+        if len(args) > 0:
+            args_array = (c_char_p * len(args))(*[b(x) for x in args])
+
+        unsaved_array = None
+        if len(unsaved_files) > 0:
+            unsaved_array = (_CXUnsavedFile * len(unsaved_files))()
+            for i, (name, contents) in enumerate(unsaved_files):
+                if hasattr(contents, "read"):
+                    contents = contents.read()
+                contents = b(contents)
+                unsaved_array[i].name = b(fspath(name))
+                unsaved_array[i].contents = contents
+                unsaved_array[i].length = len(contents)
+
+        errors = []
+        callbacks = self._callbacks(None, on_declaration, on_reference, errors)
+        ptr = c_object_p()
+        result = conf.lib.clang_indexSourceFile(self, None,
+                                    byref(callbacks), sizeof(callbacks),
+                                    options,
+                                    fspath(filename) if filename is not None else None,
+                                    args_array, len(args),
+                                    unsaved_array, len(unsaved_files),
+                                    byref(ptr), tu_options)
+
+        tu = TranslationUnit(ptr, self.index) if ptr else None
+        if errors:
+            raise errors[0]
+        if result != 0 or tu is None:
+            raise TranslationUnitLoadError("Error indexing source file.")
+
+        return tu
+
 # Now comes the plumbing to hook up the C library.
 
 # Register callback types in common container.
@@ -3326,6 +3719,37 @@ callbacks['translation_unit_includes'] = CFUNCTYPE(None, c_object_p,
 callbacks['cursor_visit'] = CFUNCTYPE(c_int, Cursor, Cursor, py_object)
 callbacks['fields_visit'] = CFUNCTYPE(c_int, Cursor, py_object)
 
+# The indexer callbacks are kept apart as they are members of a structure rather
+# than arguments, and unused members must stay NULL.
+callbacks_index = {}
+callbacks_index['abort_query'] = CFUNCTYPE(c_int, c_void_p, c_void_p)
+callbacks_index['diagnostic'] = CFUNCTYPE(None, c_void_p, c_void_p, c_void_p)
+callbacks_index['entered_main_file'] = CFUNCTYPE(c_void_p, c_void_p, c_void_p,
+        c_void_p)
+callbacks_index['included_file'] = CFUNCTYPE(c_void_p, c_void_p, c_void_p)
+callbacks_index['imported_ast_file'] = CFUNCTYPE(c_void_p, c_void_p, c_void_p)
+callbacks_index['started_translation_unit'] = CFUNCTYPE(c_void_p, c_void_p,
+        c_void_p)
+callbacks_index['declaration'] = CFUNCTYPE(None, c_void_p,
+        POINTER(IdxDeclInfo))
+callbacks_index['entity_reference'] = CFUNCTYPE(None, c_void_p,
+        POINTER(IdxEntityRefInfo))
+
+class IndexerCallbacks(Structure):
+    """
+    The set of callbacks invoked by the indexing API (IndexerCallbacks).
+    """
+    _fields_ = [
+        ("abortQuery", callbacks_index['abort_query']),
+        ("diagnostic", callbacks_index['diagnostic']),
+        ("enteredMainFile", callbacks_index['entered_main_file']),
+        ("ppIncludedFile", callbacks_index['included_file']),
+        ("importedASTFile", callbacks_index['imported_ast_file']),
+        ("startedTranslationUnit", callbacks_index['started_translation_unit']),
+        ("indexDeclaration", callbacks_index['declaration']),
+        ("indexEntityReference", callbacks_index['entity_reference']),
+    ]
+
 # Functions strictly alphabetical order.
 functionList = [
   ("clang_annotateTokens",
@@ -3751,6 +4175,14 @@ functionList = [
    [TranslationUnit, File, c_uint],
    SourceLocation),
 
+  ("clang_Location_isFromMainFile",
+   [SourceLocation],
+   bool),
+
+  ("clang_Location_isInSystemHeader",
+   [SourceLocation],
+   bool),
+
   ("clang_getNullCursor",
    None,
    Cursor),
@@ -3876,6 +4308,28 @@ functionList = [
    [Cursor],
    c_uint),
 
+  ("clang_IndexAction_create",
+   [Index],
+   c_object_p),
+
+  ("clang_IndexAction_dispose",
+   [IndexAction]),
+
+  ("clang_indexLoc_getCXSourceLocation",
+   [IdxLoc],
+   SourceLocation),
+
+  ("clang_indexSourceFile",
+   [IndexAction, c_void_p, POINTER(IndexerCallbacks), c_uint, c_uint,
+    c_interop_string, POINTER(c_char_p), c_int, POINTER(_CXUnsavedFile),
+    c_uint, POINTER(c_object_p), c_uint],
+   c_int),
+
+  ("clang_indexTranslationUnit",
+   [IndexAction, c_void_p, POINTER(IndexerCallbacks), c_uint, c_uint,
+    TranslationUnit],
+   c_int),
+
   ("clang_isAttribute",
    [CursorKind],
    bool),
@@ -4213,6 +4667,8 @@ __all__ = [
     'File',
     'FixIt',
     'Index',
+    'IndexAction',
+    'IndexEntityKind',
     'LinkageKind',
     'SourceLocation',
     'SourceRange',
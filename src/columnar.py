@@ -0,0 +1,135 @@
+from array import array
+from types import GeneratorType
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 整数列，其余的列都是字符串，保存为StringTable中的id
+INT_COLUMNS = ('line', 'col')
+# 记录数超过上次去重后的两倍(且不少于该值)时，再次去重
+COMPACT_MIN = 1 << 16
+
+
+class StringTable:
+    """字符串与整数id的双向映射，同一个字符串(比如头文件的路径)只保存一份"""
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, string: str) -> int:
+        idx = self.ids.get(string)
+        if idx is None:
+            idx = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return idx
+
+    def __getitem__(self, idx: int) -> str:
+        return self.strings[idx]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+def pack_keys(columns: list):
+    """将多列非负整数合并为一列int64，各列的值都相同时结果相同
+
+    按混合进制逐列合并，将要溢出时先把已合并的部分用np.unique重新编号为0..n-1
+    """
+    key = columns[0].astype(np.int64)
+    for column in columns[1:]:
+        base = int(column.max()) + 1 if len(column) else 1
+        if len(key) and int(key.max()) >= (1 << 62) // base:
+            key = np.unique(key, return_inverse=True)[1].ravel().astype(np.int64)
+        key = key * base + column
+    return key
+
+
+class FactTable:
+    """列式存储的一组记录，每列都是一个array('i')，字符串列保存其在StringTable中的id
+
+    每条记录只占 4 * 列数 个字节，而元组形式的记录包括其中的路径字符串，要占用数百个字节
+    """
+
+    def __init__(self, columns: tuple, strings: StringTable):
+        self.columns = columns
+        self.strings = strings
+        self._is_string = [column not in INT_COLUMNS for column in columns]
+        self.data = [array('i') for _ in columns]
+        # 上次去重后的记录数
+        self._compacted = 0
+
+    def __len__(self):
+        return len(self.data[0])
+
+    def extend(self, records):
+        """追加记录，记录为元组(只有一列时也可以是单个值)，重复的记录会在去重时删除"""
+        intern = self.strings.intern
+        columns = list(zip(self.data, self._is_string))
+        for record in records:
+            if not isinstance(record, tuple):
+                record = (record,)
+            for (data, is_string), value in zip(columns, record):
+                data.append(intern(value) if is_string else value)
+        if len(self) > 2 * max(self._compacted, COMPACT_MIN):
+            self.compact()
+
+    def column(self, name: str):
+        """某一列的数据，有numpy时为ndarray(不复制)，否则为array"""
+        data = self.data[self.columns.index(name)]
+        return np.frombuffer(data, dtype=np.intc) if np is not None else data
+
+    def compact(self):
+        """删除重复的记录，保留每条记录首次出现的位置"""
+        if np is not None:
+            keys = pack_keys([self.column(name) for name in self.columns])
+            indices = np.sort(np.unique(keys, return_index=True)[1])
+            self.data = [array('i', np.frombuffer(data, dtype=np.intc)[indices].tobytes()) for data in self.data]
+        else:
+            rows = list(dict.fromkeys(zip(*self.data)))
+            self.data = [array('i', column) for column in zip(*rows)] or [array('i') for _ in self.columns]
+        self._compacted = len(self)
+
+    def row(self, idx: int) -> tuple:
+        """解码第idx条记录为元组"""
+        return tuple(
+            self.strings[data[idx]] if is_string else data[idx]
+            for data, is_string in zip(self.data, self._is_string)
+        )
+
+
+class FactStore:
+    """列式存储的decls与refs，两者共用一个StringTable，所以可以直接比较id
+
+    :param decl_columns: 声明的各列，见DeclRefVisitor.decl_columns
+    :param ref_columns: 引用的各列，也是与声明比较的键
+    """
+
+    def __init__(self, decl_columns: tuple, ref_columns: tuple):
+        self.strings = StringTable()
+        self.decls = FactTable(decl_columns, self.strings)
+        self.refs = FactTable(ref_columns, self.strings)
+
+    def add(self, decls, refs):
+        self.decls.extend(decls)
+        self.refs.extend(refs)
+
+    def unused(self) -> GeneratorType:
+        """产生没有被引用的声明，形式与元组形式的记录相同；有numpy时以np.isin比较合并后的键"""
+        self.decls.compact()
+        self.refs.compact()
+        key_columns = self.refs.columns
+        if np is not None:
+            n = len(self.decls)
+            keys = pack_keys([
+                np.concatenate((self.decls.column(name), self.refs.column(name))) for name in key_columns
+            ])
+            indices = np.flatnonzero(~np.isin(keys[:n], keys[n:]))
+        else:
+            refs = set(zip(*self.refs.data))
+            decl_keys = zip(*[self.decls.column(name) for name in key_columns])
+            indices = [idx for idx, key in enumerate(decl_keys) if key not in refs]
+        for idx in indices:
+            yield self.decls.row(int(idx))
@@ -0,0 +1,91 @@
+import json
+import os
+import shlex
+import sys
+from os.path import join as p_join, abspath, isdir
+from types import GeneratorType
+
+from arguments import ArgRewriter
+
+WHITESPACE = ' \t\n\r'
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 16) -> GeneratorType:
+    """逐个产生json文件中顶层数组的元素，每次只读取chunk_size个字符，无需将整个文件读入内存"""
+    decoder = json.JSONDecoder()
+    with open(path, 'rt', encoding='utf8') as fp:
+        buf, pos = '', 0
+        started = False
+        eof = False
+        while True:
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+            if pos == len(buf):
+                chunk = fp.read(chunk_size)
+                if not chunk:
+                    raise ValueError('{}: unexpected end of file'.format(path))
+                buf, pos = chunk, 0
+                continue
+            char = buf[pos]
+            if not started:
+                if char != '[':
+                    raise ValueError('{}: expect a json array'.format(path))
+                started = True
+                pos += 1
+            elif char == ']':
+                return
+            elif char == ',':
+                pos += 1
+            else:
+                error, delimited = None, False
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except ValueError as e:
+                    error = e
+                else:
+                    # 元素之后须是,或]，否则数字等标量可能被截断，比如23456被分为23与456，1.5被分为1与.5
+                    nxt = end
+                    while nxt < len(buf) and buf[nxt] in WHITESPACE:
+                        nxt += 1
+                    delimited = nxt < len(buf) and buf[nxt] in ',]'
+                # 元素不完整或可能被截断时，读取更多内容后重试
+                if (error is not None or not delimited) and not eof:
+                    chunk = fp.read(chunk_size)
+                    if chunk:
+                        buf, pos = buf[pos:] + chunk, 0
+                    else:
+                        eof = True
+                    continue
+                if error is not None:
+                    raise error
+                if nxt < len(buf) and not delimited:
+                    raise ValueError("{}: expect ',' or ']' after an element".format(path))
+                pos = end
+                yield item
+
+
+def iter_compile_commands(path: str, rewriter: ArgRewriter = None, chunk_size: int = 1 << 16) -> GeneratorType:
+    """流式读取compile_commands.json，不经过libclang，逐个产生改写后的编译参数
+
+    path可以是compile_commands.json或其所在的目录，支持arguments与command两种形式；
+    源文件总是放在最后，所有参数都经过sys.intern，相同的参数在各命令间共享同一个字符串
+    """
+    if isdir(path):
+        path = p_join(path, 'compile_commands.json')
+    rewriter = rewriter or ArgRewriter()
+    for entry in iter_json_array(path, chunk_size):
+        directory = entry.get('directory', os.getcwd())
+        if 'arguments' in entry:
+            arguments = entry['arguments']
+        else:
+            arguments = shlex.split(entry['command'])
+        arguments = [sys.intern(arg) for arg in arguments]
+        # 源文件可能不是最后一个参数，比如cc -c foo.c -o foo.o
+        file = entry['file']
+        source = abspath(p_join(directory, file))
+        for idx in range(len(arguments) - 1, 0, -1):
+            if arguments[idx] == file or abspath(p_join(directory, arguments[idx])) == source:
+                del arguments[idx]
+                break
+        arguments.append(sys.intern(source))
+        yield rewriter.rewrite(arguments, directory)
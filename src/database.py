@@ -0,0 +1,87 @@
+import sqlite3
+from types import GeneratorType
+
+
+def table_name(kind: str) -> str:
+    return kind.replace('-', '_')
+
+
+class FactDatabase:
+    """以SQLite保存声明与引用，供transport='sqlite'使用
+
+    每个visitor对应两张表：声明表的列为visitor.decl_columns；引用表的列为visitor.ref_columns再加上所在的编译单元(tu)。
+    未被引用的声明由带索引的反连接(NOT EXISTS)求出，运行结束后数据仍可查询，比如哪些编译单元引用了某个函数
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def create(self, visitor, drop: bool = False):
+        """创建visitor的表与索引，drop为True时先删除已有的数据"""
+        decls, refs = table_name(visitor.decl_kind), table_name(visitor.ref_kind)
+        decl_cols, ref_cols = ', '.join(visitor.decl_columns), ', '.join(visitor.ref_columns)
+        with self.conn:
+            if drop:
+                self.conn.execute('DROP TABLE IF EXISTS {}'.format(decls))
+                self.conn.execute('DROP TABLE IF EXISTS {}'.format(refs))
+            self.conn.execute('CREATE TABLE IF NOT EXISTS {} ({}, UNIQUE ({}))'.format(decls, decl_cols, decl_cols))
+            self.conn.execute('CREATE TABLE IF NOT EXISTS {} ({}, tu, UNIQUE ({}, tu))'.format(refs, ref_cols, ref_cols))
+            # 引用表的唯一约束同时也是按ref_columns查找的索引
+            self.conn.execute('CREATE INDEX IF NOT EXISTS {0}_name ON {0} ({1})'.format(decls, visitor.decl_columns[0]))
+            if 'file' in visitor.decl_columns and 'line' in visitor.decl_columns:
+                self.conn.execute('CREATE INDEX IF NOT EXISTS {0}_location ON {0} (file, line)'.format(decls))
+
+    def insert(self, visitor, decls, refs, tu: str):
+        """插入一个编译单元的数据，已有的记录会被忽略"""
+        decl_table, ref_table = table_name(visitor.decl_kind), table_name(visitor.ref_kind)
+        as_row = lambda record: record if isinstance(record, tuple) else (record,)
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO {} VALUES ({})'.format(decl_table, ', '.join('?' * len(visitor.decl_columns))),
+            (as_row(decl) for decl in decls)
+        )
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO {} VALUES ({}, ?)'.format(ref_table, ', '.join('?' * len(visitor.ref_columns))),
+            (as_row(ref) + (tu,) for ref in refs)
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def absorb(self, path: str, visitors: list):
+        """合并另一个数据库(比如某个子进程写入的)中的数据"""
+        self.conn.execute('ATTACH DATABASE ? AS other', (path,))
+        try:
+            with self.conn:
+                for visitor in visitors:
+                    for kind in (visitor.decl_kind, visitor.ref_kind):
+                        self.conn.execute('INSERT OR IGNORE INTO main.{0} SELECT * FROM other.{0}'.format(table_name(kind)))
+        finally:
+            self.conn.execute('DETACH DATABASE other')
+
+    def unused(self, visitor) -> GeneratorType:
+        """产生没有被引用的声明，形式与visitor.decls中的记录相同"""
+        decls, refs = table_name(visitor.decl_kind), table_name(visitor.ref_kind)
+        on = ' AND '.join('r.{0} = d.{0}'.format(column) for column in visitor.ref_columns)
+        sql = 'SELECT d.* FROM {} AS d WHERE NOT EXISTS (SELECT 1 FROM {} AS r WHERE {})'.format(decls, refs, on)
+        yield from self.conn.execute(sql)
+
+    def referenced_by(self, visitor, **key) -> list:
+        """引用了某个声明的编译单元，key为ref_columns中的列，比如name='foo'"""
+        if not key:
+            raise ValueError('at least one of {} is required'.format(', '.join(visitor.ref_columns)))
+        unknown = set(key) - set(visitor.ref_columns)
+        if unknown:
+            raise ValueError('unknown column(s): {}'.format(', '.join(sorted(unknown))))
+        where = ' AND '.join('{} = ?'.format(column) for column in key)
+        sql = 'SELECT DISTINCT tu FROM {} WHERE {}'.format(table_name(visitor.ref_kind), where)
+        return [row[0] for row in self.conn.execute(sql, tuple(key.values()))]
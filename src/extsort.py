@@ -0,0 +1,50 @@
+import hashlib
+import heapq
+import os
+import pickle
+from types import GeneratorType
+
+# 每次pickle.dump的记录数，读取时每次只有一批在内存中
+BATCH_SIZE = 10000
+
+
+def fingerprint(key) -> int:
+    """记录的64位指纹，用于排序与比较，冲突的概率可以忽略"""
+    return int.from_bytes(hashlib.blake2b(repr(key).encode('utf8'), digest_size=8).digest(), 'big')
+
+
+def write_run(path: str, items: list):
+    """将已排序的记录分批写入文件(一个有序段)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fp:
+        for i in range(0, len(items), BATCH_SIZE):
+            pickle.dump(items[i:i + BATCH_SIZE], fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_run(path: str) -> GeneratorType:
+    with open(path, 'rb') as fp:
+        while True:
+            try:
+                batch = pickle.load(fp)
+            except EOFError:
+                return
+            yield from batch
+
+
+def merge_runs(paths: list) -> GeneratorType:
+    """k路归并多个有序段"""
+    return heapq.merge(*[read_run(path) for path in paths])
+
+
+def difference(decls, refs) -> GeneratorType:
+    """有序的(指纹, 记录)与有序的指纹之差，产生指纹不在refs中的记录，重复的记录只产生一次"""
+    refs = iter(refs)
+    ref = next(refs, None)
+    last = None
+    for fp, record in decls:
+        while ref is not None and ref < fp:
+            ref = next(refs, None)
+        if ref == fp or (fp, record) == last:
+            continue
+        last = fp, record
+        yield record
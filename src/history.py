@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+from os.path import dirname
+
+
+def command_key(cmd: list) -> str:
+    """以源文件路径与编译参数的哈希作为编译命令的键"""
+    digest = hashlib.sha1('\0'.join(cmd).encode('utf8')).hexdigest()[:16]
+    return '{}:{}'.format(cmd[-1], digest)
+
+
+def dump_json(data, path: str):
+    """先写入临时文件再替换，避免中途退出时留下不完整的文件"""
+    directory = dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp = '{}.{}'.format(path, os.getpid())
+    with open(tmp, 'wt') as fp:
+        json.dump(data, fp, indent=4, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def load_json(path: str, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'rt') as fp:
+        return json.load(fp)
+
+
+class CostHistory:
+    """记录每个编译单元的耗时(解析+遍历)，下次运行时按耗时从大到小调度
+
+    数据以json格式保存，键为源文件路径与编译参数的哈希，值为秒数
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.costs = load_json(path, {})
+
+    key = staticmethod(command_key)
+
+    def get(self, cmd: list, default: float = None) -> float:
+        return self.costs.get(self.key(cmd), default)
+
+    def record(self, cmd: list, seconds: float):
+        self.costs[self.key(cmd)] = round(seconds, 3)
+
+    def sort(self, commands: list) -> list:
+        """按历史耗时从大到小排序(LPT)，没有记录的命令按平均耗时估算"""
+        if not self.costs:
+            return list(commands)
+        avg = sum(self.costs.values()) / len(self.costs)
+        return sorted(commands, key=lambda cmd: self.get(cmd, avg), reverse=True)
+
+    def save(self):
+        dump_json(self.costs, self.path)
+
+
+class SkipList:
+    """记录处理超时的编译命令，之后的运行中将其排除或放到最后处理"""
+
+    def __init__(self, path: str):
+        self.path = path
+        # 键 -> 源文件
+        self.entries = load_json(path, {})
+
+    def __contains__(self, cmd: list) -> bool:
+        return command_key(cmd) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, cmd: list):
+        self.entries[command_key(cmd)] = cmd[-1]
+
+    def discard(self, cmd: list):
+        self.entries.pop(command_key(cmd), None)
+
+    def save(self):
+        dump_json(self.entries, self.path)
@@ -0,0 +1,39 @@
+import json
+import os
+from os.path import join as p_join
+
+from cache import digest, fingerprints, unchanged
+from history import dump_json, load_json
+
+
+class IncrementalState:
+    """增量分析的状态：每个编译命令上次处理时依赖的文件及其指纹
+
+    据此无需调用libclang即可算出编译单元的指纹(参数与所有依赖文件指纹的哈希)，
+    依赖文件有变化时则无法得到指纹，须重新处理。
+    每个命令对应一个json文件，子进程各自写入自己处理的命令对应的文件
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, cmd: list) -> str:
+        return p_join(self.directory, digest(*cmd) + '.json')
+
+    @staticmethod
+    def tu_key(cmd: list, deps: dict) -> str:
+        return digest(json.dumps([cmd, deps], sort_keys=True))
+
+    def record(self, cmd: list, deps: set) -> str:
+        """记录编译单元依赖的文件，返回其指纹"""
+        deps = fingerprints(deps)
+        dump_json(deps, self.path(cmd))
+        return self.tu_key(cmd, deps)
+
+    def fingerprint(self, cmd: list):
+        """返回编译单元的指纹，没有记录或依赖的文件有变化时返回None"""
+        deps = load_json(self.path(cmd), None)
+        if deps is None or not unchanged(deps):
+            return None
+        return self.tu_key(cmd, deps)
@@ -1,18 +1,30 @@
-import json
+import operator
 import os
 import pickle
 import signal
 import sys
+import time
 from abc import ABC, abstractmethod
+from enum import IntEnum
 from functools import reduce
-from itertools import groupby
-from os.path import join as p_join, abspath, isabs, dirname
-from pprint import pprint
+from itertools import chain
+from os.path import join as p_join, abspath, dirname, splitext
 from types import GeneratorType
+from uuid import uuid4
 
+from arguments import ArgRewriter
+from cache import AstCache, FactCache, dependencies, digest
 from clang.cindex import *
-from tu_flag import TranslationUnitFlags
-from utils import equal_slice, catch_error
+from columnar import FactStore
+from database import FactDatabase
+from extsort import difference, fingerprint, merge_runs, write_run
+from history import CostHistory, SkipList
+from incremental import IncrementalState
+from pch import CXX_EXTS, PchBuilder, compile_flags, scan_includes
+from pool import WorkerPool
+from sink import ResultSink, open_sink
+from tu_flag import Need, TranslationUnitFlags, derive_tu_flag
+from utils import catch_error, describe_status, send_msg, recv_msg
 
 
 # 主进程收到int信号时，同时也杀掉所有子进程
@@ -23,43 +35,235 @@ def handle_sigint(signo, frame):
 
 signal.signal(signal.SIGINT, handle_sigint)
 
+# 存放中间结果的目录
+TMP_DIR = p_join(dirname(abspath((dirname(__file__)))), 'tmp')
 
-def get_all_compile_commands(path: str) -> GeneratorType:
-    """从compile_commands.json中获取编译选项，并将相对路径转为绝对路径"""
+
+class Scope(IntEnum):
+    """遍历的范围，根据编译单元中顶层节点(比如函数，宏定义)的位置进行筛选
+
+    使用libclang判断位置，只需比较整数，无需获取文件名，且适用于不在/usr下的sysroot
+    """
+    # 所有节点
+    ALL = 0
+    # 跳过位于系统头文件中的顶层节点
+    SKIP_SYSTEM_HEADERS = 1
+    # 只访问位于主文件中的顶层节点
+    MAIN_FILE_ONLY = 2
+
+
+def is_system_file(file: str) -> bool:
+    """是否是系统头文件"""
+    return file.startswith('/usr') or file.startswith('/Library')
+
+
+def get_all_compile_commands(path: str, rewriter: ArgRewriter = None) -> GeneratorType:
+    """从compile_commands.json中获取编译选项，并由rewriter改写(去掉无关的参数，相对路径转为绝对路径)
+
+    rewriter为None时使用默认的ArgRewriter
+    """
+    rewriter = rewriter or ArgRewriter()
     db = CompilationDatabase.fromDirectory(path)
     commands = db.getAllCompileCommands()
     for cmd in commands:
-        directory = cmd.directory
-        arguments = []
-        for arg in cmd.arguments:
-            if arg.startswith('-I') and arg[2] != '/':
-                arguments.append('-I' + abspath(p_join(directory, arg[2:])))
-            else:
-                arguments.append(arg)
-        if not isabs(arguments[-1]):
-            arguments[-1] = abspath(p_join(directory, arguments[-1]))
-        yield arguments
+        yield rewriter.rewrite(list(cmd.arguments), cmd.directory)
 
 
 class Analyzer:
     """解析的入口
     :param clang_lib_path: The directory of libclang.so
+    :param visitor: 一个或一组visitor，一组visitor时每个编译单元只解析和遍历一次，每个visitor分别store与merge
     :param excluded_decls_from_pch: This process of creating the 'pre-compiled header (PCH)', loading it separately,
            and using it (via -include-pch) allows 'excludeDeclsFromPCH' to remove redundant callbacks.
            more info about pch, see <http://clang.llvm.org/docs/PCHInternals.html>
+    :param history_file: 保存每个编译单元历史耗时的文件，为None时不记录也不排序
+    :param timeout: 每个编译单元的最长处理时间(秒)，超时的子进程会被杀死并由新的子进程替代，仅在多进程模式下有效
+    :param skip_file: 记录超时命令的文件，为None时不记录
+    :param exclude_skipped: 为True时排除曾经超时的命令，否则将其放到最后处理
+    :param scope: 遍历的范围，见Scope
+    :param transport: 子进程将数据交给主进程的方式
+           'pipe': 每处理完一个编译单元即通过管道发送给主进程，主进程边接收边合并，visitor需实现shard与absorb，
+                   有visitor未实现时改用'pickle'
+           'pickle': 使用Visitor.store保存至tmp/pickle下，由merge读取
+           'sqlite': 每个子进程将声明与引用写入各自的SQLite数据库，结束时合并至database，
+                     未被引用的声明由带索引的反连接求出，见FactDatabase；visitor需声明decl_columns与ref_columns
+    :param engine: 产生数据的方式
+           'cursor': 遍历语法树，对kinds中的每个节点调用Visitor.visit
+           'index': 使用libclang的索引API，遍历在C中完成，只对声明与引用调用Visitor.index_declaration与index_reference
+    :param pch: 为编译参数相同的一组命令中，至少这一比例的编译单元所包含的头文件生成PCH，并加入-include-pch，
+           为None时不生成。与excluded_decls_from_pch同时使用时，PCH中的声明由单独解析前缀头文件得到
+    :param ast_cache: AST缓存的大小上限(MB)，为None时不缓存。命中时从tmp/ast加载，而不是重新解析
+    :param incremental: 为True时保存每个编译单元的依赖文件与visitor产生的数据(Visitor.facts)，
+           之后的运行中只重新处理参数或依赖文件有变化的编译单元，其余的直接合并缓存的数据。
+           数据按编译单元的指纹与visitor的版本缓存在tmp/facts下，见FactCache
+    :param database: transport为'sqlite'时保存结果的数据库，运行结束后仍可查询
     """
     def __init__(self,
                  clang_lib_path: str,
                  visitor,
-                 excluded_decls_from_pch: bool = False):
+                 excluded_decls_from_pch: bool = False,
+                 history_file: str = p_join(TMP_DIR, 'history.json'),
+                 timeout: float = None,
+                 skip_file: str = p_join(TMP_DIR, 'skip.json'),
+                 exclude_skipped: bool = False,
+                 scope: int = 0,
+                 transport: str = 'pipe',
+                 engine: str = 'cursor',
+                 pch: float = None,
+                 ast_cache: int = None,
+                 incremental: bool = False,
+                 database: str = p_join(TMP_DIR, 'facts.db')):
         Config.set_library_path(clang_lib_path)
         self.excluded_decls = excluded_decls_from_pch
-        self.visitor = visitor
+        # 多个visitor共享同一次解析与遍历
+        self.visitors = list(visitor) if isinstance(visitor, (list, tuple)) else [visitor]
+        self.history = CostHistory(history_file) if history_file else None
+        self.timeout = timeout
+        self.skip = SkipList(skip_file) if skip_file else None
+        self.exclude_skipped = exclude_skipped
+        self.scope = Scope(scope)
+        if transport not in ('pipe', 'pickle', 'sqlite'):
+            raise ValueError('unknown transport: {}'.format(transport))
+        # 只实现了store与merge的visitor无法通过管道发送数据
+        if transport == 'pipe' and not all(v.handles('shard') and v.handles('absorb') for v in self.visitors):
+            transport = 'pickle'
+        if transport == 'sqlite':
+            for visitor in self.visitors:
+                if not hasattr(visitor, 'decl_columns'):
+                    raise ValueError('{} does not support sqlite transport'.format(type(visitor).__name__))
+        self.transport = transport
+        self.database = database
+        if engine not in ('cursor', 'index'):
+            raise ValueError('unknown engine: {}'.format(engine))
+        if engine == 'index':
+            for visitor in self.visitors:
+                if not visitor.supports_index():
+                    raise ValueError('{} does not support index engine'.format(type(visitor).__name__))
+        self.engine = engine
+        self.pch = PchBuilder(p_join(TMP_DIR, 'pch'), pch) if pch else None
+        self.ast_cache = AstCache(p_join(TMP_DIR, 'ast'), ast_cache * 1024 * 1024) if ast_cache else None
+        if incremental:
+            for visitor in self.visitors:
+                if not visitor.handles('facts'):
+                    raise ValueError('{} does not support incremental analysis'.format(type(visitor).__name__))
+        self.incremental = IncrementalState(p_join(TMP_DIR, 'incremental')) if incremental else None
+        self.fact_cache = FactCache(p_join(TMP_DIR, 'facts')) if incremental else None
+        # 导致子进程崩溃的命令
+        self.failed = []
+        # 超时的命令
+        self.timed_out = []
+        # 由start_pool创建的常驻子进程池
+        self.pool = None
+
+    def tu_flag(self) -> int:
+        """由所有visitor的需求推导出的flag，再加上visitor手动设置的flag"""
+        derived = derive_tu_flag(visitor.needs if visitor.needs is not None else Need.All for visitor in self.visitors)
+        return reduce(operator.or_, (visitor.tu_flag for visitor in self.visitors), derived)
+
+    def fact_keys(self) -> list:
+        """每个visitor在FactCache中的键，包括影响其数据的配置，但不包括其他visitor"""
+        # 是否跳过#include取决于所有的visitor，会影响数据
+        single_file = bool(self.tu_flag() & TranslationUnitFlags.SingleFileParse)
+        return [digest(type(visitor).__name__, visitor.version, self.engine, int(self.scope), self.excluded_decls,
+                       single_file)
+                for visitor in self.visitors]
+
+    def in_scope(self):
+        """返回根据位置判断是否在遍历范围内的函数，范围为Scope.ALL时返回None"""
+        if self.scope == Scope.SKIP_SYSTEM_HEADERS:
+            return lambda location: not location.is_in_system_header
+        if self.scope == Scope.MAIN_FILE_ONLY:
+            return lambda location: location.is_from_main_file
+        return None
 
     def traverse(self, node: Cursor):
-        self.visitor.visit(node)
-        for child in node.get_children():
-            self.traverse(child)
+        """访问node及其所有子孙节点
+
+        整棵树只调用一次clang_visitChildren，而不是对每个节点调用get_children并递归，
+        既减少了每个节点的开销，也不会因语法树过深而超出递归深度限制
+        """
+        dispatcher = Dispatcher(self.visitors)
+        callback, kinds = dispatcher.callback, dispatcher.kinds
+        if kinds is None or node._kind_id in kinds:
+            if callback(node, 0) in (VisitResult.SKIP, VisitResult.ABORT):
+                return
+
+        in_scope = self.in_scope()
+        if in_scope is None:
+            node.walk(callback, kinds)
+            return
+
+        # 按位置筛选顶层节点，再分别遍历其子树
+        def top(cursor, depth):
+            if not in_scope(cursor.location):
+                return VisitResult.SKIP
+            if kinds is None or cursor._kind_id in kinds:
+                result = callback(cursor, depth)
+                if result in (VisitResult.SKIP, VisitResult.ABORT):
+                    return result
+            cursor.walk(lambda c, d: callback(c, d + depth), kinds)
+            return VisitResult.ABORT if dispatcher.finished else VisitResult.SKIP
+
+        node.walk(top)
+
+    def index(self, tu: TranslationUnit):
+        """使用libclang的索引API处理编译单元
+
+        语法树的遍历在C中完成，只有声明与实体引用才会回调Python；
+        visitor之间不能互相跳过子树，范围按每个声明或引用本身的位置筛选
+        """
+        in_scope = self.in_scope()
+
+        def fanout(handlers):
+            if not handlers:
+                return None
+            if len(handlers) == 1 and in_scope is None:
+                return handlers[0]
+
+            def handle(info):
+                if in_scope is not None and not in_scope(info.location):
+                    return
+                for handler in handlers:
+                    handler(info)
+            return handle
+
+        on_declaration = fanout([v.index_declaration for v in self.visitors if v.handles('index_declaration')])
+        on_reference = fanout([v.index_reference for v in self.visitors if v.handles('index_reference')])
+        options = reduce(operator.or_, (visitor.index_options for visitor in self.visitors), 0)
+        IndexAction.create(tu.index).index_translation_unit(tu, on_declaration, on_reference, options)
+
+    def parse(self, index: Index, cmd: list) -> TranslationUnit:
+        """解析编译单元，使用AST缓存时优先从缓存加载"""
+        options = self.tu_flag()
+        if self.ast_cache is not None:
+            tu = self.ast_cache.load(index, cmd, options)
+            if tu is not None:
+                return tu
+        tu = TranslationUnit.from_source(
+            None,
+            args=cmd,
+            index=index,
+            options=options
+        )
+        if self.ast_cache is not None:
+            self.ast_cache.store(cmd, options, tu)
+        return tu
+
+    def handle_one(self, index: Index, cmd: list) -> float:
+        """解析并遍历单个编译单元，返回耗时"""
+        t0 = time.time()
+        tu = self.parse(index, cmd)
+        if any(visitor.verbose for visitor in self.visitors):
+            print(tu.spelling, file=sys.stderr)
+        if self.engine == 'index':
+            self.index(tu)
+        else:
+            self.traverse(tu.cursor)
+        if self.incremental is not None:
+            tu_key = self.incremental.record(cmd, dependencies(tu, cmd))
+            for key, visitor in zip(self.fact_keys(), self.visitors):
+                self.fact_cache.save(tu_key, key, visitor.facts())
+        return time.time() - t0
 
     # Python中现有的并行方案都没法使用，得自行调用fork进行处理
     # 1. multiprocessing.Pool: ctypes objects containing pointers cannot be pickled
@@ -67,133 +271,626 @@ class Analyzer:
     # 3. concurrent.futures.ProcessPoolExecutor: dead lock
     def handle_simple(self, commands):
         index = Index.create(self.excluded_decls)
+        # 增量分析时，Visitor.facts只能包含当前编译单元的数据，每个编译单元处理完后须reset，最后再合并
+        shards = []
+        db = FactDatabase(self.database) if self.transport == 'sqlite' else None
         for cmd in commands:
-            tu = TranslationUnit.from_source(
-                None,
-                args=cmd,
-                index=index,
-                options=self.visitor.tu_flag
-            )
-            self.traverse(tu.cursor)
-        self.visitor.store()
+            self.finish(cmd, self.handle_one(index, cmd))
+            if db is not None:
+                self.insert(db, cmd)
+            elif self.incremental is not None:
+                shards.append([visitor.shard() for visitor in self.visitors])
+                for visitor in self.visitors:
+                    visitor.reset()
+        for data in shards:
+            for visitor, shard in zip(self.visitors, data):
+                visitor.absorb(shard)
+        if db is not None:
+            db.close()
+        # 实现了absorb的visitor(比如DeclRefVisitor)在merge时直接使用当前进程中的数据，无需保存；
+        # 只实现了store与merge的visitor只能由merge从磁盘读取，仍须保存
+        if self.transport == 'pickle':
+            for visitor in self.visitors:
+                if not visitor.handles('absorb'):
+                    visitor.store()
+
+    def insert(self, db: FactDatabase, cmd: list):
+        """将当前编译单元的数据写入数据库并清空
+
+        声明使用去重后的shard，引用则使用完整的facts，以便记录每个编译单元引用了什么
+        """
+        for visitor in self.visitors:
+            decls, _ = visitor.shard()
+            _, refs = visitor.facts()
+            db.insert(visitor, decls, refs, cmd[-1])
+            visitor.reset()
+        db.commit()
+
+    def finish(self, cmd: list, elapsed: float):
+        """记录一个已成功处理的命令的耗时"""
+        if self.history is not None:
+            self.history.record(cmd, elapsed)
+        if self.skip is not None:
+            self.skip.discard(cmd)
+
+    def work(self, req_fd: int, task_fd: int):
+        """子进程的入口，协议见WorkerPool
+
+        每处理完一个命令即保存结果或将其发送给主进程，即使之后崩溃，已完成的工作也不会丢失
+        """
+        # NOTE: 每个进程应独立创建index，否则可能会发生未预期的行为
+        # index在子进程的整个生命周期中复用
+        index = Index.create(self.excluded_decls)
+        while True:
+            visitors = recv_msg(task_fd)
+            if visitors is None:
+                break
+            self.visitors = visitors
+            elapsed, data = None, None
+            db = None
+            while True:
+                send_msg(req_fd, (elapsed, data))
+                cmd = recv_msg(task_fd)
+                if cmd is None:
+                    break
+                elapsed = self.handle_one(index, cmd)
+                if self.transport == 'pipe':
+                    data = [visitor.shard() for visitor in self.visitors]
+                    for visitor in self.visitors:
+                        visitor.reset()
+                elif self.transport == 'sqlite':
+                    # 每个子进程写入自己的数据库，避免争用写锁；每个编译单元都提交，主进程合并时数据已完整
+                    if db is None:
+                        db = FactDatabase(p_join(self.worker_db_dir(), '{}.db'.format(os.getpid())))
+                        for visitor in self.visitors:
+                            db.create(visitor)
+                    self.insert(db, cmd)
+                else:
+                    for visitor in self.visitors:
+                        visitor.flush()
+            if db is not None:
+                db.close()
+
+    def worker_db_dir(self) -> str:
+        return self.database + '.d'
+
+    def prepare_database(self):
+        """清空上次运行的结果，并删除残留的子进程数据库"""
+        os.makedirs(self.worker_db_dir(), exist_ok=True)
+        for file in os.listdir(self.worker_db_dir()):
+            os.remove(p_join(self.worker_db_dir(), file))
+        db = FactDatabase(self.database)
+        for visitor in self.visitors:
+            db.create(visitor, drop=True)
+            visitor.database = self.database
+        db.close()
+
+    def merge_databases(self, reused: list):
+        """将子进程的数据库以及未变化的编译单元缓存的数据合并至database"""
+        db = FactDatabase(self.database)
+        for file in os.listdir(self.worker_db_dir()):
+            if file.endswith('.db'):
+                db.absorb(p_join(self.worker_db_dir(), file), self.visitors)
+        for file in os.listdir(self.worker_db_dir()):
+            os.remove(p_join(self.worker_db_dir(), file))
+        keys = self.fact_keys()
+        for tu_key, source in reused:
+            for key, visitor in zip(keys, self.visitors):
+                decls, refs = self.fact_cache.load(tu_key, key)
+                db.insert(visitor, decls, refs, source)
+        db.commit()
+        db.close()
+
+    def start_pool(self, num: int = None):
+        """预先fork子进程，之后的run都会复用这些子进程，直到调用close"""
+        if self.pool is None:
+            # 先加载libclang再fork，子进程无需再次加载，且可以共享内存页
+            conf.lib
+            self.pool = WorkerPool(num or os.cpu_count(), self.work)
+        return self.pool
+
+    def close(self):
+        """关闭子进程池"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def handle_fork(self, commands, num):
-        slices = equal_slice(commands, num)
-        pids = []
-
-        for idx in range(num):
-            pid = os.fork()
-            if pid == 0:
-                signal.signal(signal.SIGINT, signal.SIG_DFL)
-                # NOTE: 每个进程应独立创建index，否则可能会发生未预期的行为
-                index = Index.create(self.excluded_decls)
-                for cmd in slices(idx):
-                    tu = TranslationUnit.from_source(
-                        None,
-                        args=cmd,
-                        index=index,
-                        options=self.visitor.tu_flag
-                    )
-                    self.traverse(tu.cursor)
-                self.visitor.store()
-                sys.exit(0)
-            else:
-                pids.append(pid)
-
-        while len(pids):
-            # TODO: waitpid 在 MacOS 10.14.5下会等待所有进程结束后才返回，与linux下不一样？
-            pid, status = os.waitpid(-1, 0)
-            # this shall not happen...
-            if pid == -1 or pid == 0:
-                print('sys error', file=sys.stderr)
-                return
-            else:
-                pids.remove(pid)
+        pool = self.pool or WorkerPool(num, self.work)
+        events = pool.map(self.visitors, commands, self.timeout)
+        try:
+            for event, cmd, value in events:
+                if event == 'data':
+                    for visitor, data in zip(self.visitors, value):
+                        visitor.absorb(data)
+                elif event == 'done':
+                    self.finish(cmd, value)
+                elif event == 'timeout':
+                    self.timed_out.append(cmd)
+                    if self.skip is not None:
+                        self.skip.add(cmd)
+                    print('timed out after {}s: {}'.format(self.timeout, cmd[-1]), file=sys.stderr)
+                else:
+                    self.failed.append(cmd)
+                    print('worker {}: {}'.format(describe_status(value), cmd[-1]), file=sys.stderr)
+        finally:
+            # 处理事件时抛出异常，须立即关闭生成器，让仍在当前job中的子进程回到等待job的状态，
+            # 否则常驻的子进程池在下一次run时会错乱
+            events.close()
+            if pool is not self.pool:
+                pool.close()
 
     # Python标准库中的方法均无效，得自行调用fork处理
     # 1. multiprocessing.Pool: ctypes objects containing pointers cannot be pickled
     # 2. concurrent.futures.ProcessPoolExecutor: dead lock
-    def run(self, commands: list, use_fork=True, output_file=None):
+    def filter_unchanged(self, commands, reused: list) -> GeneratorType:
+        """产生需要重新处理的命令，其余命令的(编译单元指纹, 源文件)放入reused"""
+        keys = self.fact_keys()
+        for cmd in commands:
+            tu_key = self.incremental.fingerprint(cmd)
+            if tu_key is not None and all(self.fact_cache.has(tu_key, key) for key in keys):
+                reused.append((tu_key, cmd[-1]))
+            else:
+                yield cmd
+
+    def filter_skipped(self, commands, skipped: list) -> GeneratorType:
+        """产生不在SkipList中的命令，其余的放入skipped"""
+        for cmd in commands:
+            if cmd in self.skip:
+                skipped.append(cmd)
+            else:
+                yield cmd
+
+    def run(self, commands, use_fork=True, output_file=None, sink: ResultSink = None):
+        """处理一组编译命令并输出结果，commands为列表时按历史耗时排序，为迭代器时流式处理
+
+        结果由merge逐条产生并写入sink；未指定sink时按output_file的扩展名选择(见sink.open_sink)，
+        .jsonl为JSON Lines，.pickle为pickle流，其余为紧凑的JSON，未指定output_file时输出至标准输出
+        """
+        # visitor可能需要额外的编译命令，比如单独解析头文件
+        for visitor in self.visitors:
+            commands = visitor.prepare(commands)
+        # 共享的头文件只在生成PCH时解析一次
+        if self.pch is not None:
+            commands, headers = self.pch.build(list(commands), self.tu_flag())
+            print('{} pch(s) built'.format(len(headers)), file=sys.stderr)
+            if self.excluded_decls:
+                commands += headers
+        # 给定的不是列表而是迭代器(比如iter_compile_commands)时，边读取边处理，第一个编译单元无需等待全部命令读取完毕，
+        # 以下的筛选都是惰性的，但无法按耗时排序
+        streaming = not isinstance(commands, list)
+        # 参数与依赖文件都没有变化的编译单元，直接使用上次的数据
+        reused = []
+        if self.incremental is not None:
+            commands = self.filter_unchanged(commands, reused)
+        # 耗时长的编译单元先开始，避免其在最后才被分配而拖长整体时间
+        if self.history is not None and not streaming:
+            commands = self.history.sort(commands)
+        # 曾经超时的命令
+        skipped = []
+        if self.skip:
+            commands = self.filter_skipped(commands, skipped)
+            if not self.exclude_skipped:
+                commands = chain(commands, skipped)
+        if not streaming:
+            commands = list(commands)
+        if self.transport == 'sqlite':
+            self.prepare_database()
+        self.failed = []
+        self.timed_out = []
         cpus = os.cpu_count()
-        # 当待分析的文件较少时，单进程即可
-        if len(commands) < cpus or not use_fork:
+        # 当待分析的文件较少时，单进程即可，但看门狗需要在主进程中运行
+        if self.pool is not None:
+            self.handle_fork(commands, len(self.pool))
+        elif not use_fork:
             self.handle_simple(commands)
+        elif streaming:
+            self.handle_fork(commands, cpus)
+        elif len(commands) < cpus:
+            if self.timeout:
+                self.handle_fork(commands, len(commands))
+            else:
+                self.handle_simple(commands)
         # 多进程处理
         else:
             self.handle_fork(commands, os.cpu_count())
 
-        result = self.visitor.merge()
-        if not output_file:
-            pprint(result)
+        if self.history is not None:
+            self.history.save()
+        if self.skip is not None:
+            self.skip.save()
+        if self.ast_cache is not None:
+            self.ast_cache.evict()
+        if self.incremental is not None:
+            print('{} translation unit(s) unchanged'.format(len(reused)), file=sys.stderr)
+        if self.transport == 'sqlite':
+            self.merge_databases(reused)
         else:
-            with open(output_file, 'wt') as fp:
-                json.dump(result, fp, indent=4)
+            keys = self.fact_keys()
+            for tu_key, _ in reused:
+                for key, visitor in zip(keys, self.visitors):
+                    visitor.absorb(self.fact_cache.load(tu_key, key))
+        if skipped and self.exclude_skipped:
+            print('{} translation unit(s) excluded by {}'.format(len(skipped), self.skip.path), file=sys.stderr)
+        for title, cmds in (('failed', self.failed), ('timed out', self.timed_out)):
+            if cmds:
+                print('{} translation unit(s) {}:'.format(len(cmds), title), file=sys.stderr)
+                for cmd in cmds:
+                    print('  ' + cmd[-1], file=sys.stderr)
+        if sink is None:
+            sink = open_sink(output_file)
+        names = [type(visitor).__name__ for visitor in self.visitors]
+        with sink:
+            for idx, (name, visitor) in enumerate(zip(names, self.visitors)):
+                if len(self.visitors) == 1:
+                    name = None
+                elif names.count(name) > 1:
+                    name = '{}[{}]'.format(name, idx)
+                sink.begin(name)
+                for record in visitor.merge() or ():
+                    sink.write(record)
+                sink.end()
+
+
+class VisitResult(IntEnum):
+    """Visitor.visit的返回值，控制遍历的方式，取值与libclang中的CXChildVisitResult一致"""
+    # 停止遍历当前编译单元
+    ABORT = 0
+    # 跳过当前节点的子节点
+    SKIP = 1
+    # 继续访问子节点，visit返回None时同
+    CONTINUE = 2
+
+
+class Dispatcher:
+    """遍历时将每个节点分发给对其感兴趣的visitor
+
+    每个visitor可以独立地跳过子树或停止遍历，只有所有visitor都不再需要某棵子树时才真正跳过，
+    每个编译单元须使用新的Dispatcher
+
+    某个visitor跳过的子树，在之后分发的节点深度不大于该子树的根时结束。被kinds筛掉的节点不会分发，
+    跳过就无法按时结束(比如之后的namespace中的节点仍被当作在子树中)，所以有visitor跳过时kinds包含所有类型
+    """
+
+    # 所有节点类型
+    ALL_KINDS = frozenset(kind.value for kind in CursorKind.get_all_kinds())
+
+    def __init__(self, visitors: list):
+        self.visitors = [(visitor.visit, visitor.kind_ids()) for visitor in visitors]
+        # 所有visitor感兴趣的节点类型的并集
+        self.union = None
+        if all(kinds is not None for _, kinds in self.visitors):
+            self.union = frozenset().union(*(kinds for _, kinds in self.visitors))
+        # 传给Cursor.walk的筛选条件，遍历时会就地修改
+        self.kinds = set(self.union) if self.union is not None else None
+        # 每个visitor跳过的子树的深度，None表示没有跳过
+        self.skipped = [None] * len(visitors)
+        # 正在跳过子树的visitor个数
+        self.skipping = 0
+        self.aborted = [False] * len(visitors)
+        self.callback = self.dispatch_one if len(visitors) == 1 else self.dispatch
+
+    @property
+    def finished(self) -> bool:
+        """是否所有visitor都已停止遍历当前编译单元"""
+        return all(self.aborted)
+
+    def dispatch_one(self, cursor: Cursor, depth: int):
+        result = self.visitors[0][0](cursor)
+        if result == VisitResult.ABORT:
+            self.aborted[0] = True
+        return result
+
+    def dispatch(self, cursor: Cursor, depth: int):
+        kind = cursor._kind_id
+        # 不再需要当前节点的子树的visitor个数
+        done = 0
+        for idx, (visit, kinds) in enumerate(self.visitors):
+            if self.aborted[idx]:
+                done += 1
+                continue
+            if self.skipped[idx] is not None:
+                if depth > self.skipped[idx]:
+                    done += 1
+                    continue
+                self.skipped[idx] = None
+                self.skip_changed(-1)
+            if kinds is not None and kind not in kinds:
+                continue
+            result = visit(cursor)
+            if result == VisitResult.ABORT:
+                self.aborted[idx] = True
+                done += 1
+            elif result == VisitResult.SKIP:
+                self.skipped[idx] = depth
+                self.skip_changed(1)
+                done += 1
+        if done < len(self.visitors):
+            return VisitResult.CONTINUE
+        return VisitResult.ABORT if self.finished else VisitResult.SKIP
+
+    def skip_changed(self, delta: int):
+        """更新正在跳过子树的visitor个数，开始或结束跳过时切换kinds"""
+        self.skipping += delta
+        if self.kinds is None:
+            return
+        if self.skipping == 1 and delta > 0:
+            self.kinds.update(self.ALL_KINDS)
+        elif self.skipping == 0:
+            self.kinds.intersection_update(self.union)
 
 
 class Visitor(ABC):
-    # 每个visitor可能需要不同的flag，比如仅寻找函数声明时，无需解析函数体
+    # 对解析结果的需求(见tu_flag.Need)，Analyzer据此选择flag，比如仅寻找函数声明时，无需解析函数体
+    # 为None时按需要完整的解析结果处理
+    needs = None
+    # 在由needs推导出的flag之外，额外需要的flag
     tu_flag = 0
     # 是否打印详细信息，比如访问每个文件前，输出文件名
     verbose = True
+    # 感兴趣的节点类型，为None时访问所有节点
+    # 遍历时直接比较整数_kind_id，其他类型的节点不会调用visit
+    kinds = None
+    # 使用索引API时的选项，见IndexAction.INDEX_OPT_XXX
+    index_options = 0
+    # 数据的版本，修改了visit等影响数据的逻辑后须更新，以免使用缓存的旧数据
+    version = '1'
 
-    _TMP_DIR = p_join(dirname(abspath((dirname(__file__)))), 'tmp/pickle')
+    _TMP_DIR = p_join(TMP_DIR, 'pickle')
+    # 当前进程调用flush的次数
+    _seq = 0
 
     @classmethod
     def set_tu_flag(cls, flag: int = 0):
         """设置翻译选项"""
         cls.tu_flag = flag
 
+    @classmethod
+    def kind_ids(cls):
+        """kinds对应的整数集合"""
+        if cls.kinds is None:
+            return None
+        return frozenset(kind.value for kind in cls.kinds)
+
     def visit(self, node: Cursor):
-        """访问每个节点，产生数据"""
-        if self.verbose:
-            if node.kind == Cursor.TRANSLATION_UNIT:
-                print(node.spelling, file=sys.stderr)
+        """访问每个节点(若指定了kinds，则只访问这些类型的节点)，产生数据
+
+        可以返回VisitResult来跳过当前节点的子节点，或者停止遍历当前编译单元
+        """
+
+    def prepare(self, commands):
+        """运行前调整待处理的编译命令，返回新的命令，默认不变"""
+        return commands
+
+    def index_declaration(self, info):
+        """使用索引API时，访问每个声明(IdxDeclInfo)，info仅在调用期间有效"""
+
+    def index_reference(self, info):
+        """使用索引API时，访问每个实体引用(IdxEntityRefInfo)，info仅在调用期间有效"""
+
+    @classmethod
+    def handles(cls, name: str) -> bool:
+        """子类是否重写了名为name的方法"""
+        return getattr(cls, name) is not getattr(Visitor, name)
+
+    @classmethod
+    def supports_index(cls) -> bool:
+        """是否支持索引API"""
+        return cls.handles('index_declaration') or cls.handles('index_reference')
 
     @staticmethod
     def dump(data, directory, filename):
         """使用pickle系列化数据至指定的文件中"""
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        with open(p_join(directory, filename), 'wb') as fp:
+        # 多个子进程可能同时创建该目录
+        os.makedirs(directory, exist_ok=True)
+        # 先写临时文件再替换，子进程在写入时被杀死(比如超时)也不会留下不完整的数据
+        path = p_join(directory, filename)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as fp:
             pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
 
     @abstractmethod
     def store(self):
         """保存子进程产生的所有数据"""
 
+    def reset(self):
+        """清空已经由store保存的数据，默认不清空，此时每次store会保存全部数据"""
+
+    def shard(self):
+        """返回自上次reset以来产生的数据，用于通过管道发送给主进程"""
+        raise NotImplementedError('{} does not support pipe transport'.format(type(self).__name__))
+
+    def absorb(self, data):
+        """在主进程中合并由shard或facts产生的数据"""
+        raise NotImplementedError('{} does not support pipe transport'.format(type(self).__name__))
+
+    def facts(self):
+        """返回当前编译单元产生的全部数据(不因之前的编译单元而去重)，用于增量分析，须能由absorb合并"""
+        raise NotImplementedError('{} does not support incremental analysis'.format(type(self).__name__))
+
+    def flush(self):
+        """保存目前为止产生的数据并清空，每个编译单元处理完后调用"""
+        self.store()
+        self.reset()
+        self._seq += 1
+
+    def shard_name(self) -> str:
+        """同一个子进程可能多次store，文件名为: pid-序号"""
+        return '{}-{}'.format(os.getpid(), self._seq)
+
     @staticmethod
-    def load_from_dir(directory) -> list:
-        """把一个目录下所有由pickle.dump序列化的数据load进列表中"""
-        ml = []
+    def iter_dir(directory) -> GeneratorType:
+        """逐个产生一个目录下由pickle.dump序列化的数据，调用方处理完一个再读取下一个"""
+        if not os.path.exists(directory):
+            return
         for file in os.listdir(directory):
+            # 被杀死的子进程留下的临时文件
+            if file.endswith('.tmp'):
+                continue
             with open(p_join(directory, file), 'rb') as fp:
-                ml.append(pickle.load(fp))
-        return ml
+                data = pickle.load(fp)
+            yield data
+            # 读取下一个之前释放当前的数据
+            del data
+
+    @classmethod
+    def load_from_dir(cls, directory) -> list:
+        """把一个目录下所有由pickle.dump序列化的数据load进列表中"""
+        return list(cls.iter_dir(directory))
 
     @abstractmethod
     def merge(self):
-        """合并所有子进程产生的数据，并进行去重，过滤，筛选等处理"""
+        """合并所有子进程产生的数据，并进行去重，过滤，筛选等处理
 
+        返回记录的可迭代对象，最好是生成器，这样每产生一条记录就可以写入输出，无需持有完整的结果
+        """
 
-class MacroVisitor(Visitor):
-    """寻找未被使用的宏"""
 
-    tu_flag = TranslationUnitFlags.DetailedPreprocessingRecord
+class DeclRefVisitor(Visitor):
+    """收集声明(decls)与引用(refs)的visitor，子类实现visit与merge
+
+    :param spill_limit: 主进程中decls与refs的记录数之和超过该值时，将其按指纹排序后写入磁盘(有序段)并清空，
+           最后通过k路归并求出未被引用的声明，内存占用与数据总量无关；为None时全部在内存中处理
+    :param columnar: 主进程中合并的数据以列式存储(见columnar.FactStore)，名字与路径只保存一份，
+           内存占用约为元组形式的十分之一，不能与spill_limit同时使用
+    """
 
-    def __init__(self):
+    # 存放decls与refs的子目录，也是sqlite中的表名
+    decl_kind = 'decl'
+    ref_kind = 'ref'
+    # decls与refs中记录的各字段在sqlite中的列名，ref_columns同时也是与声明比较的列
+    decl_columns = ('name', 'line', 'col', 'file')
+    ref_columns = ('name', 'line', 'col', 'file')
+
+    def __init__(self, spill_limit: int = None, columnar: bool = False):
+        if spill_limit is not None and columnar:
+            raise ValueError('spill_limit and columnar can not be used together')
         # 同一个头文件可能会被多次include，为了防止出现重复，须使用set，做好的方式是使用PCH
         self.decls = set()
         self.refs = set()
-        self._md_dir = p_join(self._TMP_DIR, 'md', str(int(time.time())))
-        self._mr_dir = p_join(self._TMP_DIR, 'mr', str(int(time.time())))
+        # 已经store过的数据，仅用于去重，避免每个编译单元都重复保存头文件中的声明
+        self._stored_decls = set()
+        self._stored_refs = set()
+        # 同一秒内可能创建多个visitor(或有多个并发的运行)，目录名中须加入随机数
+        run_id = '{}-{}'.format(int(time.time()), uuid4().hex[:8])
+        self._decl_dir = p_join(self._TMP_DIR, self.decl_kind, run_id)
+        self._ref_dir = p_join(self._TMP_DIR, self.ref_kind, run_id)
+        self.spill_limit = spill_limit
+        self._run_dir = p_join(self._TMP_DIR, 'runs', run_id)
+        # 已写入磁盘的有序段的个数
+        self._runs = 0
+        # 使用sqlite时保存结果的数据库，由Analyzer设置
+        self.database = None
+        self._store = FactStore(self.decl_columns, self.ref_columns) if columnar else None
+
+    @staticmethod
+    def decl_key(decl):
+        """声明与引用比较时使用的键，默认为声明本身"""
+        return decl
+
+    def shard(self) -> tuple:
+        return self.decls - self._stored_decls, self.refs - self._stored_refs
+
+    def absorb(self, data: tuple):
+        decls, refs = data
+        if self._store is not None:
+            self._store.add(decls, refs)
+            return
+        self.decls |= decls
+        self.refs |= refs
+        self.maybe_spill()
+
+    def facts(self) -> tuple:
+        # 每个编译单元处理完后都会reset，此时decls与refs中只有当前编译单元的数据
+        return self.decls, self.refs
+
+    def store(self):
+        decls, refs = self.shard()
+        self.dump(decls, self._decl_dir, self.shard_name())
+        self.dump(refs, self._ref_dir, self.shard_name())
+
+    def collect(self) -> tuple:
+        """返回所有的(decls, refs)，包括当前进程中的以及子进程保存在磁盘上的
+
+        磁盘上的数据逐个读取并就地合并到decls与refs(或列式存储)中，不会同时持有所有的数据或中间结果
+        """
+        for decls in self.iter_dir(self._decl_dir):
+            self.absorb((decls, set()))
+            del decls
+        for refs in self.iter_dir(self._ref_dir):
+            self.absorb((set(), refs))
+            del refs
+        return self.decls, self.refs
+
+    def maybe_spill(self):
+        if self.spill_limit is not None and len(self.decls) + len(self.refs) > self.spill_limit:
+            self.spill()
+
+    def spill(self):
+        """将decls与refs分别排序后写入一个有序段，然后清空"""
+        decls = sorted((fingerprint(self.decl_key(decl)), decl) for decl in self.decls)
+        self.decls = set()
+        write_run(p_join(self._run_dir, 'decl-{}'.format(self._runs)), decls)
+        del decls
+        refs = sorted({fingerprint(ref) for ref in self.refs})
+        self.refs = set()
+        write_run(p_join(self._run_dir, 'ref-{}'.format(self._runs)), refs)
+        self._runs += 1
+
+    def unused(self):
+        """返回没有被引用的声明(按decl_key比较)的迭代器
+
+        数据都在内存中时直接查找集合，列式存储时按列比较；曾经写入过磁盘时，对所有有序段做k路归并，同时只有每段的一批数据在内存中
+        """
+        if self.database is not None:
+            return self.unused_in_database()
+        decls, refs = self.collect()
+        if self._store is not None:
+            # 当前进程中产生的数据(比如未使用fork时)也放入列式存储
+            self._store.add(decls, refs)
+            self.decls, self.refs = set(), set()
+            return self._store.unused()
+        if not self._runs:
+            return (decl for decl in decls if self.decl_key(decl) not in refs)
+        self.spill()
+        runs = lambda kind: [p_join(self._run_dir, '{}-{}'.format(kind, i)) for i in range(self._runs)]
+        return difference(merge_runs(runs('decl')), merge_runs(runs('ref')))
+
+    def unused_in_database(self) -> GeneratorType:
+        """由database求出没有被引用的声明，遍历结束后关闭数据库"""
+        with FactDatabase(self.database) as db:
+            yield from db.unused(self)
+
+    def reset(self):
+        self._stored_decls |= self.decls
+        self._stored_refs |= self.refs
+        self.decls = set()
+        self.refs = set()
+
+
+class MacroVisitor(DeclRefVisitor):
+    """寻找未被使用的宏"""
+
+    # 跳过函数体时其中的记号仍会经过预处理器，宏展开依然会被记录
+    needs = Need.PreprocessingRecord
+    kinds = (CursorKind.MACRO_DEFINITION, CursorKind.MACRO_INSTANTIATION)
+    decl_kind = 'md'
+    ref_kind = 'mr'
 
     @catch_error(ValueError)
     def visit(self, node: Cursor):
-        super().visit(node)
-
-        # 筛选宏定义，且宏不是通过编译选项指定
-        if node.kind == CursorKind.MACRO_DEFINITION and node.location.file:
+        # 筛选宏定义，且宏不是通过编译选项指定，也不在系统头文件中
+        if node.kind == CursorKind.MACRO_DEFINITION:
             location = node.location
+            if location.is_in_system_header or not location.file:
+                return
             self.decls.add((
                 node.displayname,
                 location.line,
@@ -207,7 +904,7 @@ class MacroVisitor(Visitor):
             location1 = node1.location
 
             # 如果file为空，则宏是编译器插入的，所以无需处理
-            if not location1.file:
+            if location1.is_in_system_header or not location1.file:
                 return
 
             self.refs.add((
@@ -217,88 +914,168 @@ class MacroVisitor(Visitor):
                 abspath(location1.file.name)
             ))
 
-    def store(self):
-        self.dump(self.decls, self._md_dir, str(os.getpid()))
-        self.dump(self.refs, self._mr_dir, str(os.getpid()))
-
     def merge(self):
+        return (
+            {'name': item[0], 'line': item[1], 'col': item[2], 'file': item[3]}
+            for item in self.unused() if self.valid(item[0], item[3])
+        )
 
-        def reducer(s1: set, s2: set) -> set:
-            return s1.union(s2)
+    @staticmethod
+    def valid(name: str, file: str) -> bool:
+        return not is_system_file(file)
 
-        decls = reduce(reducer, self.load_from_dir(self._md_dir), set())
-        refs = reduce(reducer, self.load_from_dir(self._mr_dir), set())
-        unused = [
-            {'name': item[0], 'line': item[1], 'col': item[2], 'file': item[3]}
-            for item in (decls - refs) if self.valid(item[0], item[3])
+
+class FastMacroVisitor(MacroVisitor):
+    """近似地寻找未被使用的宏，比MacroVisitor快得多，但结果是保守的(可能漏报，不会误报)
+
+    只解析每个文件本身(SingleFileParse)，不展开#include，头文件由prepare加入的命令单独解析：
+    宏定义取自每个文件自身的预处理记录，使用则是所有文件中与宏同名的标识符记号，
+    所以条件编译、注释以外的任何同名标识符都算作使用
+    """
+
+    needs = Need.PreprocessingRecord | Need.MainFileOnly
+    tu_flag = TranslationUnitFlags.Incomplete
+    # 根节点用于获取整个文件的记号
+    kinds = (CursorKind.TRANSLATION_UNIT, CursorKind.MACRO_DEFINITION)
+    decl_kind = 'fmd'
+    ref_kind = 'fmr'
+    # 引用只是标识符的名字
+    ref_columns = ('name',)
+
+    def prepare(self, commands):
+        """为编译单元直接或间接包含的每个非系统头文件加入一个命令，使用首个包含它的编译单元的参数"""
+        commands = list(commands)
+        seen = {cmd[-1] for cmd in commands}
+        # 头文件的语言取决于包含它的编译单元，而不是头文件自身的扩展名(比如.h)
+        queue = [
+            (cmd[-1], compile_flags(cmd), 'c++-header' if splitext(cmd[-1])[1] in CXX_EXTS else 'c-header')
+            for cmd in commands
         ]
-        return unused
+        headers = []
+        # 遍历时queue会不断增长，按广度优先的顺序处理
+        for source, flags, lang in queue:
+            try:
+                includes = scan_includes(source, flags)
+            except OSError:
+                continue
+            for header in includes:
+                if header not in seen and not is_system_file(header):
+                    seen.add(header)
+                    headers.append(flags + ['-x', lang, header])
+                    queue.append((header, flags, lang))
+        return commands + headers
+
+    @catch_error(ValueError)
+    def visit(self, node: Cursor):
+        if node.kind == CursorKind.TRANSLATION_UNIT:
+            prev = None
+            for token in node.get_tokens():
+                if token.kind == TokenKind.IDENTIFIER:
+                    spelling = token.spelling
+                    # #define中被定义的宏名不算使用
+                    if prev != 'define':
+                        self.refs.add(spelling)
+                    prev = spelling
+                else:
+                    prev = None
+            return VisitResult.CONTINUE
+
+        location = node.location
+        if not location.is_from_main_file or location.is_in_system_header or not location.file:
+            return
+        self.decls.add((
+            node.displayname,
+            location.line,
+            location.column,
+            abspath(location.file.name)
+        ))
 
     @staticmethod
-    def valid(name: str, file: str) -> bool:
-        return (not file.startswith('/usr')) and \
-               (not file.startswith('/Library'))
+    def decl_key(decl):
+        # 只按名字比较
+        return decl[0]
 
 
-class FuncCallVisitor(Visitor):
+class FuncCallVisitor(DeclRefVisitor):
     """寻找未被调用的函数"""
 
-    def __init__(self):
-        self.decls = set()
-        self.refs = set()
-
-        self._dir1 = p_join(self._TMP_DIR, 'func-decl', str(int(time.time())))
-        self._dir2 = p_join(self._TMP_DIR, 'func-ref', str(int(time.time())))
+    needs = Need.Declarations | Need.FunctionBodies
+    kinds = (CursorKind.FUNCTION_DECL, CursorKind.CALL_EXPR)
+    # 只需知道函数是否被引用过，每个文件中同一函数的重复引用无需回调
+    index_options = IndexAction.INDEX_OPT_SUPPRESS_REDUNDANT_REFS
+    decl_kind = 'func-decl'
+    ref_kind = 'func-ref'
+    decl_columns = ('name', 'type', 'line', 'col', 'file')
+    ref_columns = ('name', 'type')
 
     @catch_error(ValueError)
     def visit(self, node: Cursor):
         if node.kind == CursorKind.FUNCTION_DECL:
-            if node.location.file.name.startswith('/Library'):
-                return
-            self.decls.add((
-                node.spelling,
-                node.type.get_canonical().spelling,
-                node.location.line,
-                node.location.column,
-                node.location.file.name,
-                # node.is_definition(),
-                # node.linkage == LinkageKind.INTERNAL,
-            ))
+            # 系统头文件中的函数，其函数体中也不会调用被分析的函数，无需访问
+            if not self.add_decl(node):
+                return VisitResult.SKIP
         if node.kind == CursorKind.CALL_EXPR:
-            ref_node = node.referenced
-            # 为什么会为None?
-            if ref_node is None:
-                return
-            # operator new
-            if ref_node.location.file is None:
-                return
-            if ref_node.location.file.name.startswith('/Library'):
-                return
-            self.refs.add((
-                ref_node.spelling,
-                ref_node.type.get_canonical().spelling,
-            ))
+            self.add_ref(node.referenced)
 
-    def store(self):
-        self.dump(self.decls, self._dir1, str(os.getpid()))
-        self.dump(self.refs, self._dir2, str(os.getpid()))
+    @catch_error(ValueError)
+    def index_declaration(self, info):
+        if info.entity.kind == IndexEntityKind.FUNCTION:
+            self.add_decl(info.cursor)
 
-    def merge(self):
+    @catch_error(ValueError)
+    def index_reference(self, info):
+        # 除了调用，取函数地址等引用也算作使用
+        if info.referenced.kind == IndexEntityKind.FUNCTION:
+            self.add_ref(info.cursor.referenced)
+
+    def add_decl(self, node: Cursor) -> bool:
+        """记录函数声明，位于系统头文件中时返回False"""
+        location = node.location
+        if location.is_in_system_header:
+            return False
+        file = location.file
+        if file is None or is_system_file(file.name):
+            return False
+        self.decls.add((
+            node.spelling,
+            node.type.get_canonical().spelling,
+            location.line,
+            location.column,
+            file.name,
+            # node.is_definition(),
+            # node.linkage == LinkageKind.INTERNAL,
+        ))
+        return True
 
-        def reducer(s1: set, s2: set) -> set:
-            return s1.union(s2)
+    def add_ref(self, ref_node: Cursor):
+        """记录被引用的函数"""
+        # 为什么会为None?
+        if ref_node is None:
+            return
+        location = ref_node.location
+        if location.is_in_system_header:
+            return
+        # operator new
+        if location.file is None:
+            return
+        if is_system_file(location.file.name):
+            return
+        self.refs.add((
+            ref_node.spelling,
+            ref_node.type.get_canonical().spelling,
+        ))
 
-        basis = lambda x: (x[0], x[1])
+    @staticmethod
+    def decl_key(decl):
+        # 同名且同类型的声明视为同一个函数
+        return decl[0], decl[1]
 
-        decls = reduce(reducer, self.load_from_dir(self._dir1), set())
-        g_decls = {item[0]: list(item[1]) for item in groupby(sorted(decls, key=basis), basis)}
-        decls = None
-        refs = reduce(reducer, self.load_from_dir(self._dir2), set())
-        unused = set(g_decls) - refs
-        refs = None
-        result = [g_decls[key] for key in unused]
-        with open('foo.json', 'wt') as fp:
-            json.dump(result, fp, indent=4)
+    def merge(self):
+        g_decls = {}
+        for decl in self.unused():
+            g_decls.setdefault(self.decl_key(decl), []).append(decl)
+        for group in g_decls.values():
+            yield sorted(group)
 
 
 if __name__ == '__main__':
@@ -315,6 +1092,6 @@ if __name__ == '__main__':
         clang_lib_path='/usr/local/llvm/lib',
         visitor=visitor
     )
-    analyzer.run(list(get_all_compile_commands(cdb)), use_fork=True)
+    analyzer.run(list(get_all_compile_commands(cdb)), use_fork=True, output_file='foo.json')
     t2 = time.time()
     print('time used: {}'.format(t2 - t1))
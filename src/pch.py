@@ -0,0 +1,218 @@
+import hashlib
+import os
+import re
+import sys
+from collections import Counter, OrderedDict
+from os.path import join as p_join, abspath, dirname, isfile, splitext
+
+from arguments import output_arg
+from cache import dependencies, fingerprints, unchanged
+from clang.cindex import Diagnostic, Index, TranslationUnit, TranslationUnitLoadError, TranslationUnitSaveError
+from history import dump_json, load_json
+from tu_flag import TranslationUnitFlags
+
+INCLUDE_RE = re.compile(r'#\s*include\s*([<"])([^>"]+)[>"]')
+GUARD_RE = re.compile(r'\s*(#\s*pragma\s+once|#\s*ifndef\s+(\w+)\s*#\s*define\s+(\w+))')
+
+# 查找头文件的目录的参数，quote为True时只用于#include "..."
+SEARCH_ARGS = (('-iquote', True), ('-isystem', False), ('-idirafter', False), ('-I', False))
+CXX_EXTS = {'.cc', '.cp', '.cpp', '.cxx', '.c++', '.C'}
+
+
+def compile_flags(cmd: list) -> list:
+    """去掉源文件与输出相关的参数，剩下的参数相同的命令可以共享同一个PCH"""
+    flags = []
+    args = iter(cmd[:-1])
+    for arg in args:
+        has_value = output_arg(arg)
+        if has_value is None:
+            flags.append(arg)
+        elif has_value:
+            next(args, None)
+    return flags
+
+
+def search_dirs(flags: list) -> tuple:
+    """返回(#include "..."的查找目录, #include <...>的查找目录)"""
+    quoted, angled = [], []
+    args = iter(flags)
+    for arg in args:
+        for prefix, quote in SEARCH_ARGS:
+            if arg.startswith(prefix):
+                path = arg[len(prefix):] or next(args, '')
+                (quoted if quote else angled).append(path)
+                break
+    return quoted, angled
+
+
+def is_guarded(path: str) -> bool:
+    """头文件是否有#pragma once或include guard，只有这样的头文件重复包含时才是安全的"""
+    with open(path, 'rt', errors='replace') as fp:
+        head = strip_comments(fp.read(4096))
+    match = GUARD_RE.match(head)
+    return bool(match) and (match.group(2) is None or match.group(2) == match.group(3))
+
+
+def strip_comments(text: str) -> str:
+    text = re.sub(r'/\*.*?\*/', ' ', text, flags=re.S)
+    return re.sub(r'//[^\n]*', '', text)
+
+
+def resolve_include(source: str, quote: str, name: str, quoted: list, angled: list):
+    """按编译器的规则查找被包含的头文件，找不到时返回None"""
+    dirs = ([dirname(source)] + quoted + angled) if quote == '"' else angled
+    return next((abspath(p_join(d, name)) for d in dirs if isfile(p_join(d, name))), None)
+
+
+def scan_includes(source: str, flags: list) -> list:
+    """粗略扫描文件中所有能找到的#include(包括条件编译中的)，不解析文件"""
+    quoted, angled = search_dirs(flags)
+    with open(source, 'rt', errors='replace') as fp:
+        text = strip_comments(fp.read())
+    includes = []
+    for line in text.splitlines():
+        match = INCLUDE_RE.match(line.strip())
+        if match:
+            path = resolve_include(source, match.group(1), match.group(2), quoted, angled)
+            if path is not None:
+                includes.append(path)
+    return includes
+
+
+def leading_includes(source: str, flags: list) -> list:
+    """粗略扫描源文件开头连续的#include，不解析整个编译单元
+
+    遇到其他代码或预处理指令(比如#define，#if)时停止，因为之后的头文件可能依赖于它们；
+    返回的每一项为头文件的绝对路径，或者在默认目录中查找的<name>
+    """
+    quoted, angled = search_dirs(flags)
+    includes = []
+    with open(source, 'rt', errors='replace') as fp:
+        text = strip_comments(fp.read())
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = INCLUDE_RE.match(line)
+        if not match:
+            break
+        quote, name = match.groups()
+        path = resolve_include(source, quote, name, quoted, angled)
+        if path is not None:
+            if not is_guarded(path):
+                break
+            includes.append(path)
+        elif quote == '<':
+            includes.append('<{}>'.format(name))
+        else:
+            break
+    return includes
+
+
+class PchBuilder:
+    """为同一组编译参数下大多数编译单元都包含的头文件生成PCH，并在命令中加入-include-pch
+
+    编译参数(去掉源文件与输出参数后)相同的命令为一组，每组生成一个前缀头文件及其PCH，
+    各编译单元无需再重复解析这些头文件
+    """
+
+    def __init__(self, directory: str, ratio: float = 0.5, min_group: int = 2):
+        self.directory = directory
+        # 被一组中至少这一比例的编译单元包含的头文件才放入PCH
+        self.ratio = ratio
+        self.min_group = min_group
+
+    def group(self, commands: list) -> OrderedDict:
+        """按编译参数与语言分组，已经使用PCH的命令不参与"""
+        groups = OrderedDict()
+        for cmd in commands:
+            if '-include-pch' in cmd:
+                continue
+            lang = 'c++-header' if splitext(cmd[-1])[1] in CXX_EXTS else 'c-header'
+            key = tuple(compile_flags(cmd)) + (lang,)
+            groups.setdefault(key, []).append(cmd)
+        return groups
+
+    def shared_headers(self, flags: list, commands: list) -> tuple:
+        """返回(一组命令共享的头文件，按首次出现的顺序排列, 开头包含了所有这些头文件的命令)
+
+        PCH中的头文件会先于源文件中的任何代码处理，所以只对开头已经包含了它们的命令使用PCH
+        """
+        counter = Counter()
+        order = OrderedDict()
+        scanned = []
+        for cmd in commands:
+            try:
+                includes = set(leading_includes(cmd[-1], flags))
+            except OSError:
+                continue
+            scanned.append((cmd, includes))
+            counter.update(includes)
+            for header in includes:
+                order.setdefault(header, None)
+        threshold = max(self.min_group, self.ratio * len(commands))
+        shared = [header for header in order if counter[header] >= threshold]
+        return shared, [cmd for cmd, includes in scanned if includes.issuperset(shared)]
+
+    def build(self, commands: list, options: int = 0) -> tuple:
+        """生成PCH，返回(加入了-include-pch的命令, 前缀头文件的命令)
+
+        前缀头文件本身也可以作为编译单元处理，以便在使用excludeDeclsFromPCH时不遗漏头文件中的声明
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        index = Index.create()
+        # 前缀头文件中只有#include，不能跳过
+        options &= ~TranslationUnitFlags.SingleFileParse
+        options |= TranslationUnitFlags.ForSerialization | TranslationUnitFlags.Incomplete
+        pch_of = {}
+        headers = []
+        for key, group in self.group(commands).items():
+            if len(group) < self.min_group:
+                continue
+            flags, lang = list(key[:-1]), key[-1]
+            shared, users = self.shared_headers(flags, group)
+            if not shared or len(users) < self.min_group:
+                continue
+            name = hashlib.sha1('\0'.join(key + tuple(shared)).encode('utf8')).hexdigest()[:16]
+            header = p_join(self.directory, name + '.h')
+            # 文件名已包含了内容的哈希，不重写，以免改变修改时间而导致PCH被重新生成
+            if not os.path.exists(header):
+                with open(header, 'wt') as fp:
+                    for path in shared:
+                        fp.write('#include {}\n'.format(path if path.startswith('<') else '"{}"'.format(path)))
+            cmd = flags + ['-x', lang, header]
+            pch = p_join(self.directory, name + '.pch')
+            if not self.save(index, cmd, pch, options):
+                continue
+            headers.append(cmd)
+            for cmd in users:
+                pch_of[id(cmd)] = pch
+
+        result = []
+        for cmd in commands:
+            pch = pch_of.get(id(cmd))
+            result.append(cmd if pch is None else cmd[:-1] + ['-include-pch', pch, cmd[-1]])
+        return result, headers
+
+    @staticmethod
+    def save(index: Index, cmd: list, path: str, options: int) -> bool:
+        """解析前缀头文件并保存为PCH，有错误时返回False
+
+        上次生成PCH时依赖的文件都没有变化时直接复用，PCH的修改时间不变，依赖它的AST缓存仍然有效
+        """
+        manifest = path + '.json'
+        record = load_json(manifest, {})
+        if record.get('options') == options and os.path.exists(path) and unchanged(record['deps']):
+            return True
+        try:
+            tu = TranslationUnit.from_source(None, args=cmd, index=index, options=options)
+            errors = [d for d in tu.diagnostics if d.severity >= Diagnostic.Error]
+            if errors:
+                print('skip pch {}: {}'.format(cmd[-1], errors[0].spelling), file=sys.stderr)
+                return False
+            tu.save(path)
+            dump_json({'options': options, 'deps': fingerprints(dependencies(tu, cmd))}, manifest)
+        except (TranslationUnitLoadError, TranslationUnitSaveError) as e:
+            print('skip pch {}: {}'.format(cmd[-1], e), file=sys.stderr)
+            return False
+        return True
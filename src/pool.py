@@ -0,0 +1,201 @@
+import os
+import select
+import signal
+import sys
+import time
+import traceback
+from itertools import chain
+
+from utils import describe_status, send_msg, recv_msg
+
+
+class WorkerPool:
+    """常驻的子进程池，fork一次后可以反复执行(job, commands)任务
+
+    每个子进程通过两个管道与主进程通信：子进程在req管道上索要下一个命令，主进程在task管道上回复。
+    子进程的入口为work(req_fd, task_fd)，其协议如下：
+      1. 从task管道读取一个job(比如visitor)，读到None时退出
+      2. 向req管道发送(上一个命令的耗时, 其产生的数据)，第一次为(None, None)，再从task管道读取下一个命令
+      3. 读到的命令为None时表示该job已无命令，回到第1步等待下一个job
+    """
+
+    # 子进程连续在索要第一个命令之前退出的次数上限，超过时说明work在启动时就会失败(比如无法加载libclang)，
+    # 继续补充子进程只会无休止地fork
+    MAX_STARTUP_FAILURES = 3
+
+    def __init__(self, num: int, work):
+        self.work = work
+        # 主进程读取请求的fd -> (pid, 主进程发送命令的fd)
+        self.workers = {}
+        for _ in range(num):
+            self.spawn()
+
+    def __len__(self):
+        return len(self.workers)
+
+    def spawn(self) -> int:
+        """fork一个子进程，返回主进程读取其请求的fd"""
+        req_r, req_w = os.pipe()
+        task_r, task_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            os.close(req_r)
+            os.close(task_w)
+            for fd, (_, fd1) in self.workers.items():
+                os.close(fd)
+                os.close(fd1)
+            # 子进程不能使用sys.exit退出，否则会执行主进程调用栈上的finally等代码
+            code = 0
+            try:
+                self.work(req_w, task_r)
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+        else:
+            os.close(req_w)
+            os.close(task_r)
+            self.workers[req_r] = (pid, task_w)
+            return req_r
+
+    def reap(self, fd: int) -> tuple:
+        """回收一个已退出的子进程，返回(pid, status)"""
+        pid, task_fd = self.workers.pop(fd)
+        os.close(fd)
+        os.close(task_fd)
+        _, status = os.waitpid(pid, 0)
+        return pid, status
+
+    def start(self, fd: int, job, failures: int = 0) -> int:
+        """向子进程发送job，如果子进程已经退出则用新的子进程代替，返回新的fd"""
+        try:
+            send_msg(self.workers[fd][1], job)
+            return fd
+        except BrokenPipeError:
+            pid, status = self.reap(fd)
+            print('worker {} {}'.format(pid, describe_status(status)), file=sys.stderr)
+            if failures + 1 >= self.MAX_STARTUP_FAILURES:
+                raise RuntimeError('workers exited {} times in a row before starting a job'.format(failures + 1))
+            return self.start(self.spawn(), job, failures + 1)
+
+    def map(self, job, commands, timeout: float = None):
+        """在所有子进程上执行job，依次产生如下事件：
+
+        ('data', cmd, data): 子进程发来的命令产生的数据
+        ('done', cmd, elapsed): 命令处理完成
+        ('failed', cmd, status): 子进程在处理命令时崩溃
+        ('timeout', cmd, status): 子进程处理命令超时，已被杀死
+        """
+        # 不预先均分命令，而是由空闲的子进程索要下一个命令，
+        # 避免某个进程分到几个特别耗时的编译单元后，其他进程却早已空闲
+        queue = iter(commands)
+        size = len(self.workers)
+        # 参与当前job的子进程
+        active = set()
+        # fd -> 正在处理的命令
+        running = {}
+        # fd -> 当前命令的截止时间
+        deadlines = {}
+        # 因超时而被杀死的子进程对应的fd
+        killed = set()
+        # 子进程连续在索要第一个命令之前退出的次数
+        startup_failures = 0
+
+        try:
+            for fd in list(self.workers):
+                active.add(self.start(fd, job))
+            while active:
+                wait = None
+                if deadlines:
+                    wait = max(0, min(deadlines.values()) - time.time())
+                readable, _, _ = select.select(list(active), [], [], wait)
+
+                for fd in readable:
+                    try:
+                        elapsed, data = recv_msg(fd)
+                    except EOFError:
+                        # 子进程崩溃(段错误，断言失败，超时等)，启动一个新的子进程继续处理剩余的命令
+                        active.remove(fd)
+                        deadlines.pop(fd, None)
+                        cmd = running.pop(fd, None)
+                        pid, status = self.reap(fd)
+                        if cmd is None and fd not in killed:
+                            startup_failures += 1
+                            print('worker {} {}'.format(pid, describe_status(status)), file=sys.stderr)
+                            if startup_failures >= self.MAX_STARTUP_FAILURES:
+                                raise RuntimeError(
+                                    'workers exited {} times in a row before requesting a command'.format(startup_failures)
+                                )
+                        if cmd is not None:
+                            if fd in killed:
+                                yield 'timeout', cmd, status
+                            else:
+                                yield 'failed', cmd, status
+                        killed.discard(fd)
+                        active.add(self.start(self.spawn(), job))
+                        continue
+
+                    startup_failures = 0
+                    deadlines.pop(fd, None)
+                    if data is not None:
+                        yield 'data', running[fd], data
+                    if elapsed is not None:
+                        yield 'done', running[fd], elapsed
+                    if fd in killed:
+                        # 结果在杀死之前已经写入管道，命令已完成；子进程已被杀死，不再发送命令，之后读到EOF时补充新的子进程
+                        del running[fd]
+                        continue
+                    cmd = running[fd] = next(queue, None)
+                    try:
+                        send_msg(self.workers[fd][1], cmd)
+                    except BrokenPipeError:
+                        # 子进程在发送结果后退出，命令交给其他子进程，之后读到EOF时补充新的子进程
+                        del running[fd]
+                        if cmd is not None:
+                            queue = chain([cmd], queue)
+                        continue
+                    if cmd is None:
+                        active.remove(fd)
+                        del running[fd]
+                    elif timeout:
+                        deadlines[fd] = time.time() + timeout
+
+                # 看门狗：杀死超时的子进程，之后其管道会收到EOF，按崩溃处理；
+                # 先处理了已可读的fd，主进程处理数据较慢时，已经完成但结果尚未读取的子进程不会被误杀
+                now = time.time()
+                expired = [fd for fd, deadline in deadlines.items() if deadline <= now]
+                if expired:
+                    pending, _, _ = select.select(expired, [], [], 0)
+                    for fd in expired:
+                        if fd not in pending:
+                            os.kill(self.workers[fd][0], signal.SIGKILL)
+                            killed.add(fd)
+                            del deadlines[fd]
+        finally:
+            # 调用方中途抛出异常(或关闭了生成器)时，子进程仍停留在当前job中等待命令，下次map发送的job会被当作命令；
+            # 杀死这些子进程并补充新的，使所有子进程都回到等待job的状态
+            if active:
+                self.abort(active)
+            while len(self.workers) < size:
+                self.spawn()
+
+    def abort(self, fds):
+        """杀死fds对应的子进程，并用新的子进程代替"""
+        for fd in list(fds):
+            os.kill(self.workers[fd][0], signal.SIGKILL)
+            self.reap(fd)
+            self.spawn()
+
+    def close(self):
+        """通知所有子进程退出，并等待其结束"""
+        for fd in list(self.workers):
+            try:
+                send_msg(self.workers[fd][1], None)
+            except BrokenPipeError:
+                pass
+            pid, status = self.reap(fd)
+            if status != 0:
+                print('worker {} {}'.format(pid, describe_status(status)), file=sys.stderr)
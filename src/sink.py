@@ -0,0 +1,150 @@
+import json
+import pickle
+import sys
+from abc import ABC, abstractmethod
+from pprint import pprint
+from types import GeneratorType
+
+
+class ResultSink(ABC):
+    """Analyzer.run的输出方式，merge每产生一条记录就写入一条，无需先得到完整的结果
+
+    每个visitor的结果以begin开始，end结束；只有一个visitor时name为None，
+    有多个visitor时name为visitor的名字(同名时加上序号)
+
+    :param path: 输出的文件，为None时输出至标准输出
+    """
+
+    binary = False
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.fp = None
+        self.name = None
+
+    def open(self):
+        if self.path is not None:
+            self.fp = open(self.path, 'wb' if self.binary else 'wt', encoding=None if self.binary else 'utf8')
+        else:
+            self.fp = sys.stdout.buffer if self.binary else sys.stdout
+
+    def close(self):
+        if self.path is not None:
+            self.fp.close()
+        else:
+            self.fp.flush()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def begin(self, name: str = None):
+        """开始输出一个visitor的结果"""
+        self.name = name
+
+    @abstractmethod
+    def write(self, record):
+        """写入一条记录"""
+
+    def end(self):
+        """一个visitor的结果输出完毕"""
+
+
+class PrettySink(ResultSink):
+    """使用pprint逐条输出，便于阅读"""
+
+    def begin(self, name: str = None):
+        super().begin(name)
+        if name is not None:
+            print('{}:'.format(name), file=self.fp)
+
+    def write(self, record):
+        pprint(record, stream=self.fp)
+
+
+class JsonLinesSink(ResultSink):
+    """JSON Lines，每行一条记录，下游工具可以边读取边处理
+
+    有多个visitor时每行为{"visitor": 名字, "record": 记录}
+    """
+
+    def write(self, record):
+        if self.name is not None:
+            record = {'visitor': self.name, 'record': record}
+        self.fp.write(json.dumps(record, separators=(',', ':')))
+        self.fp.write('\n')
+
+
+class JsonSink(ResultSink):
+    """紧凑的JSON，结构与一次性json.dump相同：一个visitor时为记录的列表，多个时为名字到列表的对象"""
+
+    def open(self):
+        super().open()
+        self._visitors = 0
+
+    def close(self):
+        if self.name is not None:
+            self.fp.write('}')
+        self.fp.write('\n')
+        super().close()
+
+    def begin(self, name: str = None):
+        super().begin(name)
+        if name is not None:
+            self.fp.write('{' if not self._visitors else ',')
+            self.fp.write('{}:'.format(json.dumps(name)))
+        self._visitors += 1
+        self._records = 0
+        self.fp.write('[')
+
+    def write(self, record):
+        if self._records:
+            self.fp.write(',')
+        self.fp.write(json.dumps(record, separators=(',', ':')))
+        self._records += 1
+
+    def end(self):
+        self.fp.write(']')
+
+
+class PickleSink(ResultSink):
+    """pickle流，每条记录单独pickle.dump，有多个visitor时为(名字, 记录)，可由load_pickle_stream逐条读取"""
+
+    binary = True
+
+    def write(self, record):
+        if self.name is not None:
+            record = (self.name, record)
+        pickle.dump(record, self.fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_pickle_stream(path: str) -> GeneratorType:
+    """逐条读取PickleSink写入的记录"""
+    with open(path, 'rb') as fp:
+        while True:
+            try:
+                yield pickle.load(fp)
+            except EOFError:
+                return
+
+
+# 文件扩展名对应的输出方式，其余的扩展名使用JsonSink
+SINKS = {
+    '.jsonl': JsonLinesSink,
+    '.ndjson': JsonLinesSink,
+    '.pickle': PickleSink,
+    '.pkl': PickleSink,
+}
+
+
+def open_sink(path: str = None) -> ResultSink:
+    """按扩展名选择输出方式，path为None时使用PrettySink输出至标准输出"""
+    if path is None:
+        return PrettySink()
+    for ext, cls in SINKS.items():
+        if path.endswith(ext):
+            return cls(path)
+    return JsonSink(path)
@@ -1,5 +1,7 @@
 # http://clang.llvm.org/doxygen/Index_8h_source.html
-from enum import IntEnum
+import operator
+from enum import IntEnum, IntFlag
+from functools import reduce
 
 
 class TranslationUnitFlags(IntEnum):
@@ -37,3 +39,33 @@ class TranslationUnitFlags(IntEnum):
     VisitImplicitAttributes = 0x2000
     # Used to indicate that non-errors from included files should be ignored.
     IgnoreNonErrorsFromIncludedFiles = 0x4000
+
+
+class Need(IntFlag):
+    """visitor对解析结果的需求，由此推导出代价最小的TranslationUnitFlags，见derive_tu_flag"""
+    # 需要声明(函数，类型，变量等)
+    Declarations = 0x1
+    # 需要函数体中的内容，比如函数调用
+    FunctionBodies = 0x2
+    # 需要宏定义与宏展开
+    PreprocessingRecord = 0x4
+    # 只需要主文件本身的内容，无需展开头文件；此时来自头文件的声明与类型都不可用
+    MainFileOnly = 0x8
+    # 未声明需求的visitor按需要完整的解析结果处理
+    All = Declarations | FunctionBodies
+
+
+def derive_tu_flag(needs) -> int:
+    """根据一组visitor的需求推导出同时满足它们的、代价最小的flag"""
+    needs = list(needs)
+    union = reduce(operator.or_, needs, 0)
+    # 不读取诊断信息，头文件中的警告等无需生成
+    flag = TranslationUnitFlags.IgnoreNonErrorsFromIncludedFiles
+    if union & Need.PreprocessingRecord:
+        flag |= TranslationUnitFlags.DetailedPreprocessingRecord
+    if not union & Need.FunctionBodies:
+        flag |= TranslationUnitFlags.SkipFunctionBodies
+    # 只有所有visitor都不需要头文件时才能跳过#include
+    if needs and all(need & Need.MainFileOnly for need in needs):
+        flag |= TranslationUnitFlags.SingleFileParse
+    return flag
@@ -1,5 +1,7 @@
 import os
 import pickle
+import signal
+import struct
 import sys
 import time
 from functools import wraps
@@ -29,6 +31,49 @@ def equal_slice(items: list, num: int) -> callable:
     return chunk
 
 
+def write_all(fd: int, data: bytes):
+    """向fd写入全部数据，os.write可能只写入一部分"""
+    view = memoryview(data)
+    while view:
+        n = os.write(fd, view)
+        view = view[n:]
+
+
+def read_exact(fd: int, size: int) -> bytes:
+    """从fd中读取恰好size个字节，对端关闭时抛出EOFError"""
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = os.read(fd, size - len(buf))
+        if not chunk:
+            raise EOFError('fd {} closed'.format(fd))
+        buf += chunk
+    return bytes(buf)
+
+
+def send_msg(fd: int, obj):
+    """通过管道发送一条消息，格式为4字节长度 + pickle数据"""
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    write_all(fd, struct.pack('!I', len(data)) + data)
+
+
+def recv_msg(fd: int):
+    """读取一条由send_msg发送的消息"""
+    size, = struct.unpack('!I', read_exact(fd, 4))
+    return pickle.loads(read_exact(fd, size))
+
+
+def describe_status(status: int) -> str:
+    """将os.waitpid返回的status转为可读的描述"""
+    if os.WIFSIGNALED(status):
+        signo = os.WTERMSIG(status)
+        try:
+            name = signal.Signals(signo).name
+        except ValueError:
+            name = str(signo)
+        return 'killed by {}'.format(name)
+    return 'exited with {}'.format(os.WEXITSTATUS(status))
+
+
 def catch_error(err_type=Exception):
     def wrapper(func):
         @wraps(func)